@@ -2,43 +2,80 @@ import argparse
 import configparser
 import logging
 import os
-import queue
 import signal
 import threading
-from typing import Iterable
+from typing import Iterable, List, Optional, Tuple
 
 import redis
 
-from tppocr.math import RectangleTuple
-from tppocr.ocr import OCR, OCRConfig
+from tppocr.executor import new_ocr_executor
+from tppocr.framerate import AdaptiveFrameRate
+from tppocr.math import RectangleTuple, union_rectangle
+from tppocr.metrics import Metrics, MetricsPublisher
+from tppocr.ocr import OCRConfig
+from tppocr.publisher import RedisPublisher
 from tppocr.queue import ConsumerBroadcastQueue
 from tppocr.stream import LiveStream, URLStream, BaseStream
+from tppocr.tesseract import TesseractAPIPool
 from tppocr.text import TextFilter
+from tppocr.viewers import ViewerMonitor
+from tppocr.wire import WireEncoder
 
 _logger = logging.getLogger(__name__)
 
 OCR_SECTION_PREFIX = 'ocr'
 
 
-def new_stream(config: configparser.ConfigParser, config_filename: str) -> BaseStream:
-    source_input = os.path.normpath(os.path.join(
-        os.path.dirname(config_filename),
-        config['source']['input']
-    ))
+def new_stream(config: configparser.ConfigParser, config_filename: str,
+               metrics: Metrics=None) -> BaseStream:
+    source_input = get_source_input(config, config_filename)
     output_fps = config['source'].getfloat('process_output_fps')
     native_frame_rate = config['source'].get('process_native_frame_rate')
+    crop_region, crop_scale = get_stream_crop(config)
+    reconnect_min_delay = config['source'].getfloat('reconnect_min_delay', 0.5)
+    reconnect_max_delay = config['source'].getfloat('reconnect_max_delay', 30)
+    standby_decoder = config['source'].getboolean('standby_decoder', False)
 
     if config['source'].getboolean('livestreamer'):
         stream = LiveStream(source_input, output_fps=output_fps,
                             native_frame_rate=native_frame_rate,
-                            quality=config['source']['livestreamer_quality'])
+                            crop_region=crop_region, crop_scale=crop_scale,
+                            quality=config['source']['livestreamer_quality'],
+                            url_refresh_interval=config['source'].getfloat(
+                                'livestreamer_refresh_interval', 60),
+                            metrics=metrics,
+                            reconnect_min_delay=reconnect_min_delay,
+                            reconnect_max_delay=reconnect_max_delay,
+                            standby_decoder=standby_decoder)
     else:
         stream = URLStream(source_input, output_fps=output_fps,
-                           native_frame_rate=native_frame_rate)
+                           native_frame_rate=native_frame_rate,
+                           crop_region=crop_region, crop_scale=crop_scale,
+                           metrics=metrics,
+                           reconnect_min_delay=reconnect_min_delay,
+                           reconnect_max_delay=reconnect_max_delay,
+                           standby_decoder=standby_decoder)
 
     return stream
 
 
+def get_source_input(config: configparser.ConfigParser,
+                     config_filename: str) -> str:
+    return os.path.normpath(os.path.join(
+        os.path.dirname(config_filename),
+        config['source']['input']
+    ))
+
+
+def get_stream_crop(config: configparser.ConfigParser) \
+        -> Tuple[Optional[RectangleTuple], float]:
+    if config['source'].getboolean('crop_to_regions', False):
+        return (get_ocr_regions_bounding_box(config),
+                config['source'].getfloat('crop_scale', 1.0))
+    else:
+        return None, 1.0
+
+
 def new_redis_conn(config: configparser.ConfigParser) -> redis.StrictRedis:
     return redis.StrictRedis(
         config['redis']['host'], config['redis'].getint('port'),
@@ -46,24 +83,69 @@ def new_redis_conn(config: configparser.ConfigParser) -> redis.StrictRedis:
     )
 
 
+def new_adaptive_frame_rate(config: configparser.ConfigParser,
+                            metrics: Metrics) -> Optional[AdaptiveFrameRate]:
+    if not config['source'].getboolean('adaptive_fps', False):
+        return None
+
+    return AdaptiveFrameRate(
+        config['source'].getfloat('min_output_fps', 0.5),
+        config['source'].getfloat('process_output_fps'),
+        max_latency=config['source'].getfloat('max_latency', 2),
+        metrics=metrics
+    )
+
+
 def get_ocr_section_keys(config: configparser.ConfigParser) -> Iterable[str]:
     for key in config.keys():
         if key.startswith(OCR_SECTION_PREFIX):
             yield key
 
 
-def new_ocr(config: configparser.ConfigParser, ocr_section_key: str,
-            stream: BaseStream, text_filter: TextFilter,
-            frame_queue: queue.Queue) -> OCR:
-    config_section = config[ocr_section_key]
-
-    region = RectangleTuple(
+def get_ocr_region(config_section: configparser.SectionProxy) \
+        -> RectangleTuple:
+    return RectangleTuple(
         config_section.getfloat('region-x1'),
         config_section.getfloat('region-y1'),
         config_section.getfloat('region-x2'),
         config_section.getfloat('region-y2'),
     )
 
+
+def get_line_layout(config_section: configparser.SectionProxy) \
+        -> Optional[List[Tuple[float, float]]]:
+    # Comma separated lines of "top bottom"
+    if 'line-layout' not in config_section:
+        return None
+
+    region = get_ocr_region(config_section)
+    line_layout = []
+
+    for line in config_section['line-layout'].split(','):
+        y1, y2 = (float(value) for value in line.split())
+
+        if not region.y1 <= y1 < y2 <= region.y2:
+            raise ValueError('Line {} {} is not inside the region'
+                             .format(y1, y2))
+
+        line_layout.append((y1, y2))
+
+    return line_layout
+
+
+def get_ocr_regions_bounding_box(config: configparser.ConfigParser) \
+        -> RectangleTuple:
+    return union_rectangle(
+        get_ocr_region(config[key]) for key in get_ocr_section_keys(config)
+    )
+
+
+def new_ocr_config(config: configparser.ConfigParser, ocr_section_key: str) \
+        -> OCRConfig:
+    config_section = config[ocr_section_key]
+
+    region = get_ocr_region(config_section)
+
     if 'white-region-x1' in config_section:
         white_region = RectangleTuple(
             config_section.getfloat('white-region-x1'),
@@ -90,7 +172,167 @@ def new_ocr(config: configparser.ConfigParser, ocr_section_key: str,
     ocr_config.fps = config['source'].getfloat('process_output_fps')
     ocr_config.clear_adaptive_classifier = config[ocr_section_key].getboolean('clear-adaptive-classifier')
 
-    return OCR(stream, ocr_config, text_filter, frame_queue)
+    if 'change-threshold' in config_section:
+        ocr_config.change_threshold = config_section.getint('change-threshold')
+
+    if 'page-segmentation-mode' in config_section:
+        ocr_config.page_segmentation_mode = config_section.getint(
+            'page-segmentation-mode')
+
+    ocr_config.line_layout = get_line_layout(config_section)
+    ocr_config.batch_size = config_section.getint('batch-size', 1)
+    ocr_config.preprocess_engine = config_section.get('preprocess-engine', 'pil')
+    ocr_config.debug_image_interval = config_section.getfloat(
+        'debug-image-interval', 2)
+    ocr_config.debug_image_scale = config_section.getfloat(
+        'debug-image-scale', 1.0)
+    ocr_config.debug_image_quality = config_section.getint(
+        'debug-image-quality', 75)
+
+    return ocr_config
+
+
+class StreamRunner:
+    # Runs the stream, OCR and publisher of one config. Streams run by the
+    # same process can share Tesseract APIs through api_pool and
+    # keep their Redis channels and keys apart with channel_prefix.
+    def __init__(self, config: configparser.ConfigParser,
+                 config_filename: str, channel_prefix: Optional[str]=None,
+                 api_pool: TesseractAPIPool=None):
+        if channel_prefix is None:
+            channel_prefix = config['redis'].get('channel_prefix', '')
+
+        ocr_executor_name = config['source'].get('ocr_executor', 'thread')
+
+        if api_pool and ocr_executor_name != 'thread':
+            _logger.warning('The %s OCR executor does not share Tesseract '
+                            'APIs', ocr_executor_name)
+
+        if not api_pool and ocr_executor_name == 'thread' and \
+                'tesseract_pool_size' in config['source']:
+            # Shared by the sections of this stream. Otherwise, each section
+            # has its own API.
+            self._own_api_pool = api_pool = TesseractAPIPool(
+                config['source'].getint('tesseract_pool_size')
+            )
+        else:
+            self._own_api_pool = None
+
+        self.channel_prefix = channel_prefix
+        self._threads = []
+        self._metrics_publisher = None
+        self._viewer_monitor = None
+
+        metrics = Metrics()
+        self._stream = stream = new_stream(config, config_filename, metrics)
+        redis_conn = new_redis_conn(config)
+        self._publisher = publisher = RedisPublisher(
+            redis_conn, config['redis'].getint('outbox_size', 1000),
+            metrics=metrics
+        )
+        wire_format = config['redis'].get('wire_format', 'json')
+        ocr_section_keys = tuple(get_ocr_section_keys(config))
+        section_names = tuple(
+            key[len(OCR_SECTION_PREFIX):] for key in ocr_section_keys
+        )
+        frame_rate = new_adaptive_frame_rate(config, metrics)
+        consumer_broadcast_queue = ConsumerBroadcastQueue(
+            stream.frame_queue, len(ocr_section_keys), metrics=metrics,
+            consumer_names=section_names,
+            frame_rate=frame_rate
+        )
+        metrics.add_gauge('stream_queue_depth', stream.frame_queue.qsize)
+
+        self._threads.append(consumer_broadcast_queue)
+        self._threads.append(threading.Thread(target=stream.run, daemon=True))
+
+        if not config['redis'].getboolean('always_publish_debug_images',
+                                          False):
+            self._viewer_monitor = ViewerMonitor(
+                redis_conn, section_names, channel_prefix=channel_prefix
+            )
+
+        ocr_executor = new_ocr_executor(
+            ocr_executor_name, metrics, self._viewer_monitor, api_pool
+        )
+
+        for index, ocr_section_key in enumerate(ocr_section_keys):
+            text_filter = TextFilter(publisher, metrics, wire_format,
+                                     channel_prefix)
+            frame_queue = consumer_broadcast_queue.consumer_queues[index]
+            ocr_config = new_ocr_config(config, ocr_section_key)
+            ocr_executor.add_ocr(stream, ocr_config, text_filter, frame_queue)
+            metrics.add_gauge(
+                'consumer_queue_depth.{}'.format(ocr_config.section_name),
+                frame_queue.qsize
+            )
+
+        self._threads.extend(ocr_executor.workers)
+
+        metrics_interval = config['redis'].getfloat('metrics_interval', 60)
+
+        if metrics_interval:
+            wire_encoder = WireEncoder(wire_format, channel_prefix)
+
+            def publish_metrics_doc(doc: dict):
+                for channel, message in wire_encoder.encode(doc):
+                    publisher.publish(channel, message, droppable=True)
+
+            self._metrics_publisher = MetricsPublisher(
+                metrics, publish_metrics_doc, metrics_interval
+            )
+
+    def start(self):
+        if self._viewer_monitor:
+            self._viewer_monitor.start()
+
+        if self._metrics_publisher:
+            self._metrics_publisher.start()
+
+        self._publisher.start()
+
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self):
+        self._stream.stop()
+
+    def is_alive(self) -> bool:
+        # Stops being alive when any of the threads quits
+        return all(thread.is_alive() for thread in self._threads)
+
+    def join(self, timeout: float=None):
+        for thread in self._threads:
+            thread.join(timeout=timeout)
+
+    def shutdown(self):
+        self._stream.stop()
+
+        for thread in self._threads:
+            try:
+                thread.join(timeout=5)
+            except threading.ThreadError:
+                pass
+
+        if self._metrics_publisher:
+            self._metrics_publisher.stop()
+
+        if self._viewer_monitor:
+            self._viewer_monitor.stop()
+
+        self._publisher.stop()
+        self._publisher.join(timeout=5)
+
+        if self._own_api_pool:
+            self._own_api_pool.close()
+
+
+def read_config(config_filename: str) -> configparser.ConfigParser:
+    with open(config_filename) as file:
+        config = configparser.ConfigParser()
+        config.read_file(file)
+
+    return config
 
 
 def main():
@@ -110,50 +352,20 @@ def main():
 
     _logger.info('Loading config')
 
-    with open(args.config_file) as file:
-        config = configparser.ConfigParser()
-        config.read_file(file)
-
-    threads = []
-
-    stream = new_stream(config, args.config_file)
-    redis_conn = new_redis_conn(config)
-    ocr_section_keys = tuple(get_ocr_section_keys(config))
-    consumer_broadcast_queue = ConsumerBroadcastQueue(
-        stream.frame_queue, len(ocr_section_keys)
-    )
-
-    threads.append(consumer_broadcast_queue)
-    threads.append(threading.Thread(target=stream.run, daemon=True))
-
-    for index, ocr_section_key in enumerate(ocr_section_keys):
-        text_filter = TextFilter(redis_conn)
-        frame_queue = consumer_broadcast_queue.consumer_queues[index]
-        ocr = new_ocr(config, ocr_section_key, stream, text_filter, frame_queue)
-        threads.append(threading.Thread(target=ocr.run, daemon=True))
+    config = read_config(args.config_file)
+    runner = StreamRunner(config, args.config_file)
 
     def stop_handler(dummy1, dummy2):
-        stream.stop()
+        runner.stop()
 
     signal.signal(signal.SIGINT, stop_handler)
 
-    for thread in threads:
-        thread.start()
-
-    while True:
-        for thread in threads:
-            thread.join(timeout=1)
-
-        if any(not thread.is_alive() for thread in threads):
-            break
+    runner.start()
 
-    stream.stop()
+    while runner.is_alive():
+        runner.join(timeout=1)
 
-    for thread in threads:
-        try:
-            thread.join(timeout=5)
-        except threading.ThreadError:
-            pass
+    runner.shutdown()
 
     _logger.info('Exiting')
 
@@ -0,0 +1,378 @@
+import argparse
+import collections
+import configparser
+import contextlib
+import json
+import logging
+import resource
+import sys
+import threading
+import time
+from typing import List, Iterable, Dict, Optional
+
+import PIL.Image
+
+from tppocr.__main__ import get_ocr_section_keys, new_ocr_config, \
+    get_stream_crop
+from tppocr.frame import FrameRing
+from tppocr.math import Size2DTuple
+from tppocr.ocr import OCR
+from tppocr.publisher import RedisPublisher
+from tppocr.queue import ConsumerBroadcastQueue
+from tppocr.stream import BaseStream
+from tppocr.tesseract import TesseractAPIPool
+from tppocr.text import TextFilter
+
+_logger = logging.getLogger(__name__)
+
+# "encode" is building the messages and queuing them on the OCR threads.
+# "publish" is the publisher thread sending them to Redis.
+STAGES = ('decode', 'preprocess', 'tesseract', 'filter', 'encode', 'publish')
+
+
+class StageTimer:
+    # Records the duration of each stage. Time spent in a nested stage is
+    # not counted in the outer stage.
+    def __init__(self):
+        self._durations = collections.defaultdict(list)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    @contextlib.contextmanager
+    def measure(self, stage: str):
+        stack = self._local.__dict__.setdefault('stack', [])
+        stack.append(0.0)
+        start_time = time.perf_counter()
+
+        try:
+            yield
+        finally:
+            duration = time.perf_counter() - start_time
+            nested_duration = stack.pop()
+
+            if stack:
+                stack[-1] += duration
+
+            with self._lock:
+                self._durations[stage].append(duration - nested_duration)
+
+    def get_durations(self, stage: str) -> List[float]:
+        with self._lock:
+            return list(self._durations[stage])
+
+
+class FakeRedis:
+    def __init__(self):
+        self.command_counts = collections.Counter()
+        self.published_bytes = 0
+
+    def publish(self, channel: str, message: str):
+        self.command_counts['publish'] += 1
+        self.published_bytes += len(message)
+
+    def rpush(self, key: str, value: str):
+        self.command_counts['rpush'] += 1
+
+    def ltrim(self, key: str, start: int, end: int):
+        self.command_counts['ltrim'] += 1
+
+    def pipeline(self, transaction: bool=True) -> 'FakeRedis':
+        return self
+
+    def execute(self, raise_on_error: bool=True) -> list:
+        return []
+
+
+class ImageStream(BaseStream):
+    # Replays still images as frames instead of running ffmpeg
+    def __init__(self, image_paths: Iterable[str], frame_count: int,
+                 stage_timer: StageTimer, **kwargs):
+        super().__init__(**kwargs)
+        self._images = list(PIL.Image.open(path) for path in image_paths)
+        self._frame_count = frame_count
+        self._stage_timer = stage_timer
+
+        for image in self._images:
+            if image.size != self._images[0].size:
+                raise ValueError('Images must be the same size')
+
+    def _get_ffmpeg_url(self) -> str:
+        return ''
+
+    def _set_image_size(self):
+        self._set_source_size(Size2DTuple(*self._images[0].size))
+
+    def run(self):
+        self._running = True
+        self._set_image_size()
+
+        frame_ring = FrameRing(self._frame_buffer_count,
+                               self.frame_size.width * self.frame_size.height)
+
+        for index in range(self._frame_count):
+            if not self._running:
+                break
+
+            with self._stage_timer.measure('decode'):
+                image = self._images[index % len(self._images)].convert('L')
+
+                if self._crop_region:
+                    image = image.crop(self.crop_rectangle)
+
+                    if image.size != self.frame_size:
+                        image = image.resize(self.frame_size)
+
+                frame = frame_ring.acquire()
+                frame.data[:] = image.tobytes()
+                frame.geometry = self.geometry
+
+            self._frame_queue.put(frame)
+
+        self._frame_queue.put(None)
+
+    def stop(self):
+        self._running = False
+
+
+class BenchmarkTextFilter(TextFilter):
+    def __init__(self, publisher: RedisPublisher, stage_timer: StageTimer):
+        super().__init__(publisher)
+        self._stage_timer = stage_timer
+
+    def feed_text(self, *args, **kwargs):
+        with self._stage_timer.measure('filter'):
+            super().feed_text(*args, **kwargs)
+
+    def feed_lines(self, *args, **kwargs):
+        with self._stage_timer.measure('filter'):
+            super().feed_lines(*args, **kwargs)
+
+    def flush_text(self, *args, **kwargs):
+        with self._stage_timer.measure('filter'):
+            super().flush_text(*args, **kwargs)
+
+    def _publish_raw_text(self, *args, **kwargs):
+        with self._stage_timer.measure('encode'):
+            super()._publish_raw_text(*args, **kwargs)
+
+    def _publish_text(self, *args, **kwargs):
+        with self._stage_timer.measure('encode'):
+            super()._publish_text(*args, **kwargs)
+
+    def _publish_image(self, *args, **kwargs):
+        with self._stage_timer.measure('encode'):
+            super()._publish_image(*args, **kwargs)
+
+
+class BenchmarkRedisPublisher(RedisPublisher):
+    def __init__(self, redis_conn: FakeRedis, stage_timer: StageTimer):
+        super().__init__(redis_conn)
+        self._stage_timer = stage_timer
+
+    def _write_batch(self, *args, **kwargs):
+        with self._stage_timer.measure('publish'):
+            super()._write_batch(*args, **kwargs)
+
+
+class BenchmarkOCR(OCR):
+    def __init__(self, *args, stage_timer: StageTimer=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._stage_timer = stage_timer
+        self.frame_count = 0
+
+    def _get_frames(self):
+        frames = super()._get_frames()
+        self.frame_count += sum(1 for frame in frames if frame)
+        return frames
+
+    def _crop_frame(self, *args, **kwargs):
+        with self._stage_timer.measure('preprocess'):
+            return super()._crop_frame(*args, **kwargs)
+
+    def _preprocess_image(self, *args, **kwargs):
+        with self._stage_timer.measure('preprocess'):
+            return super()._preprocess_image(*args, **kwargs)
+
+    def _recognize_image(self, *args, **kwargs):
+        with self._stage_timer.measure('tesseract'):
+            return super()._recognize_image(*args, **kwargs)
+
+    def _recognize_stacked_images(self, *args, **kwargs):
+        with self._stage_timer.measure('tesseract'):
+            return super()._recognize_stacked_images(*args, **kwargs)
+
+    def _recognize_lines(self, *args, **kwargs):
+        with self._stage_timer.measure('tesseract'):
+            return super()._recognize_lines(*args, **kwargs)
+
+
+def percentile(values: List[float], percent: float) -> float:
+    if not values:
+        return 0.0
+
+    values = sorted(values)
+    index = min(len(values) - 1, int(len(values) * percent / 100))
+
+    return values[index]
+
+
+def run_benchmark(config: configparser.ConfigParser,
+                  image_paths: List[str], frame_count: int,
+                  preprocess_engine: Optional[str]=None,
+                  tesseract_variables: Optional[Dict[str, str]]=None) -> dict:
+    stage_timer = StageTimer()
+    redis_conn = FakeRedis()
+    publisher = BenchmarkRedisPublisher(redis_conn, stage_timer)
+    crop_region, crop_scale = get_stream_crop(config)
+
+    stream = ImageStream(image_paths, frame_count, stage_timer,
+                         crop_region=crop_region, crop_scale=crop_scale)
+    ocr_section_keys = tuple(get_ocr_section_keys(config))
+    consumer_broadcast_queue = ConsumerBroadcastQueue(
+        stream.frame_queue, len(ocr_section_keys)
+    )
+
+    if 'tesseract_pool_size' in config['source']:
+        api_pool = TesseractAPIPool(
+            config['source'].getint('tesseract_pool_size')
+        )
+    else:
+        api_pool = None
+
+    ocrs = []
+
+    for index, ocr_section_key in enumerate(ocr_section_keys):
+        ocr_config = new_ocr_config(config, ocr_section_key)
+
+        if preprocess_engine:
+            ocr_config.preprocess_engine = preprocess_engine
+
+        if tesseract_variables:
+            ocr_config.tesseract_variables.update(tesseract_variables)
+
+        ocrs.append(BenchmarkOCR(
+            stream, ocr_config,
+            BenchmarkTextFilter(publisher, stage_timer),
+            consumer_broadcast_queue.consumer_queues[index],
+            api_pool=api_pool, stage_timer=stage_timer
+        ))
+
+    threads = [consumer_broadcast_queue,
+               threading.Thread(target=stream.run, daemon=True)]
+    threads.extend(
+        threading.Thread(target=ocr.run, daemon=True) for ocr in ocrs
+    )
+
+    start_time = time.perf_counter()
+
+    publisher.start()
+
+    for thread in threads:
+        thread.start()
+
+    for thread in threads:
+        thread.join()
+
+    publisher.stop()
+    publisher.join()
+
+    if api_pool:
+        api_pool.close()
+
+    duration = time.perf_counter() - start_time
+    processed_frame_count = sum(ocr.frame_count for ocr in ocrs)
+
+    stages = {}
+
+    for stage in STAGES:
+        durations = stage_timer.get_durations(stage)
+        stages[stage] = {
+            'count': len(durations),
+            'mean': sum(durations) / len(durations) if durations else 0.0,
+            'p50': percentile(durations, 50),
+            'p90': percentile(durations, 90),
+            'p99': percentile(durations, 99),
+            'max': max(durations) if durations else 0.0,
+        }
+
+    return {
+        'images': image_paths,
+        'sections': len(ocr_section_keys),
+        'frames': frame_count,
+        'processed_frames': processed_frame_count,
+        'duration': duration,
+        'frames_per_second': processed_frame_count / duration,
+        'stages': stages,
+        'redis_commands': dict(redis_conn.command_counts),
+        'published_bytes': redis_conn.published_bytes,
+        'peak_rss_kib': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }
+
+
+def print_results(results: dict):
+    print('Sections: {}'.format(results['sections']))
+    print('Frames: {} read, {} OCR\'d in {:.2f} s'.format(
+        results['frames'], results['processed_frames'], results['duration']))
+    print('Frames per second: {:.2f}'.format(results['frames_per_second']))
+    print('Peak RSS: {:.1f} MiB'.format(results['peak_rss_kib'] / 1024))
+    print()
+    print('{:<12} {:>7} {:>9} {:>9} {:>9} {:>9} {:>9}'.format(
+        'Stage (ms)', 'Count', 'Mean', 'p50', 'p90', 'p99', 'Max'))
+
+    for stage in STAGES:
+        info = results['stages'][stage]
+        print('{:<12} {:>7} {:>9.2f} {:>9.2f} {:>9.2f} {:>9.2f} {:>9.2f}'.format(
+            stage, info['count'],
+            *(info[key] * 1000 for key in ('mean', 'p50', 'p90', 'p99', 'max'))
+        ))
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(
+        description='Replay images through the OCR pipeline and report '
+                    'its throughput'
+    )
+    arg_parser.add_argument('config_file')
+    arg_parser.add_argument('image', nargs='+',
+                            help='Images that are replayed as frames')
+    arg_parser.add_argument('--frames', type=int, default=100)
+    arg_parser.add_argument('--preprocess-engine', choices=['pil', 'numpy'])
+    arg_parser.add_argument('--tesseract-variable', action='append',
+                            default=[], metavar='NAME=VALUE')
+    arg_parser.add_argument('--json', metavar='FILENAME',
+                            help='Write the results as JSON ("-" for stdout)')
+    arg_parser.add_argument('--debug', action='store_true')
+
+    args = arg_parser.parse_args()
+
+    logging.basicConfig(level=logging.DEBUG if args.debug else logging.WARNING,
+                        format='%(asctime)s - %(levelname)s - %(message)s')
+
+    with open(args.config_file) as file:
+        config = configparser.ConfigParser()
+        config.read_file(file)
+
+    tesseract_variables = dict(
+        item.split('=', 1) for item in args.tesseract_variable
+    )
+
+    results = run_benchmark(config, args.image, args.frames,
+                            preprocess_engine=args.preprocess_engine,
+                            tesseract_variables=tesseract_variables)
+    results['config'] = args.config_file
+    results['preprocess_engine'] = args.preprocess_engine
+    results['tesseract_variables'] = tesseract_variables
+
+    if args.json == '-':
+        json.dump(results, sys.stdout, indent=2)
+        print()
+    else:
+        print_results(results)
+
+        if args.json:
+            with open(args.json, 'w') as file:
+                json.dump(results, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+import logging
+from typing import Optional
+
+import PIL.Image
+import PIL.ImageChops
+
+_logger = logging.getLogger(__name__)
+
+
+class FrameChangeDetector:
+    # Images are downsampled to suppress video compression noise. The
+    # reference image is only replaced by changed images so slow fades are
+    # still detected.
+    def __init__(self, threshold: int=16, downsample_factor: int=2):
+        assert 0 <= threshold <= 255
+        assert downsample_factor >= 1
+
+        self._threshold = threshold
+        self._downsample_factor = downsample_factor
+        self._reference_image = None
+        self.frame_count = 0
+        self.skipped_frame_count = 0
+
+    @property
+    def skip_rate(self) -> float:
+        if not self.frame_count:
+            return 0.0
+
+        return self.skipped_frame_count / self.frame_count
+
+    def reset(self):
+        self._reference_image = None
+
+    def feed_image(self, image: PIL.Image.Image) -> bool:
+        image = self._downsample(image)
+        self.frame_count += 1
+
+        if self._is_similar(image, self._reference_image):
+            self.skipped_frame_count += 1
+            return False
+        else:
+            self._reference_image = image
+            return True
+
+    def _downsample(self, image: PIL.Image.Image) -> PIL.Image.Image:
+        factor = self._downsample_factor
+
+        if factor == 1:
+            return image
+
+        return image.resize(
+            (max(1, image.width // factor), max(1, image.height // factor)),
+            resample=PIL.Image.BOX
+        )
+
+    def _is_similar(self, image: PIL.Image.Image,
+                    reference_image: Optional[PIL.Image.Image]) -> bool:
+        if not reference_image or reference_image.size != image.size:
+            return False
+
+        difference = PIL.ImageChops.difference(image, reference_image)
+        max_difference = difference.getextrema()[1]
+
+        _logger.debug('Frame difference %s (%s)', max_difference,
+                      self._threshold)
+
+        return max_difference <= self._threshold
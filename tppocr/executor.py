@@ -0,0 +1,350 @@
+import abc
+import logging
+import multiprocessing
+import queue
+import signal
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+from tppocr.frame import FrameGeometry
+from tppocr.math import RectangleTuple, Size2DTuple
+from tppocr.metrics import Metrics
+from tppocr.ocr import OCR, OCRConfig
+from tppocr.stream import BaseStream
+from tppocr.tesseract import TesseractAPIPool
+from tppocr.text import TextFilter
+from tppocr.viewers import ViewerMonitor
+
+# Only the process executor needs them, which requires Python 3.8
+try:
+    import multiprocessing.resource_tracker
+    import multiprocessing.shared_memory
+except ImportError:
+    shared_memory_supported = False
+else:
+    shared_memory_supported = True
+
+_logger = logging.getLogger(__name__)
+
+
+class BaseOCRExecutor(metaclass=abc.ABCMeta):
+    def __init__(self, metrics: Metrics=None,
+                 viewer_monitor: ViewerMonitor=None):
+        self._workers = []
+        self._metrics = metrics or Metrics()
+        self._viewer_monitor = viewer_monitor
+
+    @property
+    def workers(self) -> List:
+        return self._workers
+
+    @abc.abstractmethod
+    def add_ocr(self, stream: BaseStream, config: OCRConfig,
+                text_filter: TextFilter, frame_queue: queue.Queue):
+        pass
+
+
+class ThreadOCRExecutor(BaseOCRExecutor):
+    def __init__(self, metrics: Metrics=None,
+                 viewer_monitor: ViewerMonitor=None,
+                 api_pool: TesseractAPIPool=None):
+        super().__init__(metrics, viewer_monitor)
+        self._api_pool = api_pool
+
+    def add_ocr(self, stream: BaseStream, config: OCRConfig,
+                text_filter: TextFilter, frame_queue: queue.Queue):
+        ocr = OCR(stream, config, text_filter, frame_queue, self._metrics,
+                  self._viewer_monitor, self._api_pool)
+        self._workers.append(threading.Thread(target=ocr.run, daemon=True))
+
+
+class ProcessOCRExecutor(BaseOCRExecutor):
+    def __init__(self, metrics: Metrics=None,
+                 viewer_monitor: ViewerMonitor=None):
+        if not shared_memory_supported:
+            raise ImportError('The process OCR executor requires Python 3.8+')
+
+        super().__init__(metrics, viewer_monitor)
+
+    def add_ocr(self, stream: BaseStream, config: OCRConfig,
+                text_filter: TextFilter, frame_queue: queue.Queue):
+        channel = SharedFrameChannel()
+        result_queue = multiprocessing.Queue()
+
+        if self._viewer_monitor:
+            has_viewers = multiprocessing.Value('b', True, lock=False)
+        else:
+            has_viewers = None
+
+        process = multiprocessing.Process(
+            target=run_ocr_process,
+            args=(config, channel, result_queue,
+                  logging.getLogger().getEffectiveLevel(), has_viewers),
+            daemon=True
+        )
+        feeder_thread = threading.Thread(
+            target=self._feed_frames,
+            args=(stream, frame_queue, channel, config.section_name,
+                  has_viewers),
+            daemon=True
+        )
+        dispatcher_thread = threading.Thread(
+            target=self._dispatch_results,
+            args=(result_queue, {
+                'text_filter': text_filter,
+                'metrics': self._metrics,
+            }),
+            daemon=True
+        )
+
+        self._workers.extend([process, feeder_thread, dispatcher_thread])
+
+    def _feed_frames(self, stream: BaseStream, frame_queue: queue.Queue,
+                     channel: 'SharedFrameChannel', section: str,
+                     has_viewers: Optional[multiprocessing.Value]):
+        while True:
+            frame = frame_queue.get()
+
+            if not frame:
+                channel.put_end()
+                break
+
+            if has_viewers is not None:
+                has_viewers.value = self._viewer_monitor.has_viewers(section)
+
+            channel.put(frame.data, frame.geometry, frame.timestamp)
+            frame.release()
+
+        channel.close()
+
+    @classmethod
+    def _dispatch_results(cls, result_queue: multiprocessing.Queue,
+                          targets: Dict[str, Any]):
+        while True:
+            item = result_queue.get()
+
+            if item is None:
+                break
+
+            target_name, method_name, args, kwargs = item
+            getattr(targets[target_name], method_name)(*args, **kwargs)
+
+
+class SharedFrameChannel:
+    # Frames are copied into slots of a shared memory block. Only the slot
+    # index and frame geometry are pickled. The shared memory is allocated
+    # by the producer once the frame size is known and reallocated when
+    # the frame size grows.
+    def __init__(self, slot_count: int=3):
+        self._slot_count = slot_count
+        self._free_slots = multiprocessing.Queue()
+        self._ready_slots = multiprocessing.Queue()
+        self._memory = None
+        self._slot_size = 0
+
+    def put(self, frame_data: memoryview, geometry: FrameGeometry,
+            timestamp: Optional[float]=None):
+        frame_data_size = len(frame_data)
+
+        if frame_data_size > self._slot_size:
+            self._allocate(frame_data_size)
+
+        index = self._free_slots.get()
+        offset = index * self._slot_size
+        self._memory.buf[offset:offset + frame_data_size] = frame_data
+        self._ready_slots.put((
+            self._memory.name, self._slot_size, index, frame_data_size,
+            geometry, timestamp
+        ))
+
+    def put_end(self):
+        self._ready_slots.put(None)
+
+    def get(self) -> Optional[Tuple[int, memoryview, FrameGeometry,
+                                    Optional[float]]]:
+        item = self._ready_slots.get()
+
+        if item is None:
+            return None
+
+        name, slot_size, index, frame_data_size, geometry, timestamp = item
+
+        if not self._memory or self._memory.name != name:
+            # The producer only reallocates when all slots are released
+            if self._memory:
+                self._memory.close()
+
+            self._memory = multiprocessing.shared_memory.SharedMemory(name)
+            # The producer owns the memory so don't let the resource tracker
+            # unlink it on behalf of the consumer
+            multiprocessing.resource_tracker.unregister(
+                self._memory._name, 'shared_memory'
+            )
+
+        offset = index * slot_size
+        frame_data = self._memory.buf[offset:offset + frame_data_size]
+
+        return index, frame_data, geometry, timestamp
+
+    def put_free_slot(self, index: int):
+        self._free_slots.put(index)
+
+    def qsize(self) -> int:
+        return self._ready_slots.qsize()
+
+    def close(self, timeout: Optional[float]=5):
+        if not self._memory:
+            return
+
+        # Wait for the consumer to return all the slots
+        try:
+            for dummy in range(self._slot_count):
+                self._free_slots.get(timeout=timeout)
+        except queue.Empty:
+            _logger.warning('Frame channel slots were not returned')
+
+        self._memory.close()
+        self._memory.unlink()
+        self._memory = None
+
+    def _allocate(self, slot_size: int):
+        if self._memory:
+            _logger.info('Frame size increased. Reallocating shared memory.')
+            self.close(timeout=None)
+
+        self._memory = multiprocessing.shared_memory.SharedMemory(
+            create=True, size=slot_size * self._slot_count
+        )
+        self._slot_size = slot_size
+
+        for index in range(self._slot_count):
+            self._free_slots.put(index)
+
+
+class _ChannelStream:
+    # Provides the frame geometry of the producer's stream to OCR in
+    # the worker process
+    def __init__(self):
+        self.frame_size = Size2DTuple(0, 0)
+        self.source_size = Size2DTuple(0, 0)
+        self.crop_rectangle = RectangleTuple(0, 0, 0, 0)
+
+
+class _ChannelFrame:
+    def __init__(self, channel: SharedFrameChannel, index: int,
+                 data: memoryview, geometry: FrameGeometry,
+                 timestamp: Optional[float]):
+        self._channel = channel
+        self._index = index
+        self._data = data
+        self.geometry = geometry
+        self.timestamp = timestamp
+
+    @property
+    def data(self) -> memoryview:
+        return self._data
+
+    def release(self):
+        self._data.release()
+        self._channel.put_free_slot(self._index)
+
+
+class _ChannelFrameQueue:
+    def __init__(self, channel: SharedFrameChannel, stream: _ChannelStream):
+        self._channel = channel
+        self._stream = stream
+
+    def get(self) -> Optional[_ChannelFrame]:
+        item = self._channel.get()
+
+        if item is None:
+            return None
+
+        index, frame_data, geometry, timestamp = item
+        self._stream.frame_size, self._stream.source_size, \
+            self._stream.crop_rectangle = geometry
+
+        return _ChannelFrame(self._channel, index, frame_data, geometry,
+                             timestamp)
+
+    def qsize(self) -> int:
+        return self._channel.qsize()
+
+
+class _RemoteTextFilter:
+    def __init__(self, result_queue: multiprocessing.Queue):
+        self._result_queue = result_queue
+
+    def feed_text(self, *args, **kwargs):
+        self._result_queue.put(('text_filter', 'feed_text', args, kwargs))
+
+    def feed_lines(self, *args, **kwargs):
+        self._result_queue.put(('text_filter', 'feed_lines', args, kwargs))
+
+    def flush_text(self, *args, **kwargs):
+        self._result_queue.put(('text_filter', 'flush_text', args, kwargs))
+
+    def feed_image(self, *args, **kwargs):
+        self._result_queue.put(('text_filter', 'feed_image', args, kwargs))
+
+
+class _SharedViewerMonitor:
+    # Viewer state copied from the main process's ViewerMonitor
+    def __init__(self, has_viewers: multiprocessing.Value):
+        self._has_viewers = has_viewers
+
+    def has_viewers(self, section: Optional[str]=None) -> bool:
+        return bool(self._has_viewers.value)
+
+
+class _RemoteMetrics(Metrics):
+    # Records into the main process's metrics
+    def __init__(self, result_queue: multiprocessing.Queue):
+        super().__init__()
+        self._result_queue = result_queue
+
+    def increment(self, *args, **kwargs):
+        self._result_queue.put(('metrics', 'increment', args, kwargs))
+
+    def observe(self, *args, **kwargs):
+        self._result_queue.put(('metrics', 'observe', args, kwargs))
+
+
+def run_ocr_process(config: OCRConfig, channel: SharedFrameChannel,
+                    result_queue: multiprocessing.Queue, log_level: int,
+                    has_viewers: Optional[multiprocessing.Value]):
+    # The main process stops the workers by ending the frame channel
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    logging.basicConfig(level=log_level,
+                        format='%(asctime)s - %(levelname)s - %(message)s')
+
+    stream = _ChannelStream()
+    frame_queue = _ChannelFrameQueue(channel, stream)
+    text_filter = _RemoteTextFilter(result_queue)
+    metrics = _RemoteMetrics(result_queue)
+
+    if has_viewers is not None:
+        viewer_monitor = _SharedViewerMonitor(has_viewers)
+    else:
+        viewer_monitor = None
+
+    try:
+        OCR(stream, config, text_filter, frame_queue, metrics,
+            viewer_monitor).run()
+    finally:
+        result_queue.put(None)
+        result_queue.close()
+        result_queue.join_thread()
+
+
+def new_ocr_executor(name: str, metrics: Metrics=None,
+                     viewer_monitor: ViewerMonitor=None,
+                     api_pool: TesseractAPIPool=None) \
+        -> BaseOCRExecutor:
+    if name == 'thread':
+        return ThreadOCRExecutor(metrics, viewer_monitor, api_pool)
+    elif name == 'process':
+        # APIs can't be shared with other processes
+        return ProcessOCRExecutor(metrics, viewer_monitor)
+    else:
+        raise ValueError('Unknown OCR executor {}'.format(name))
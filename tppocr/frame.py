@@ -0,0 +1,90 @@
+import collections
+import logging
+import queue
+import threading
+import time
+
+_logger = logging.getLogger(__name__)
+
+FrameGeometry = collections.namedtuple(
+    'FrameGeometry', ['frame_size', 'source_size', 'crop_rectangle']
+)
+
+
+class Frame:
+    # A handle to a frame stored in a FrameRing slot. The slot is returned
+    # to the ring when all the references are released.
+    def __init__(self, ring: 'FrameRing', index: int, buffer: bytearray):
+        self._ring = ring
+        self._index = index
+        self._buffer = buffer
+        self._view = memoryview(buffer)
+        self._ref_count = 0
+        # Seconds into the video, if known
+        self.timestamp = None
+        self.geometry = None
+
+    @property
+    def index(self) -> int:
+        return self._index
+
+    @property
+    def data(self) -> memoryview:
+        return self._view
+
+    def retain(self, count: int=1):
+        assert count >= 0
+
+        with self._ring.lock:
+            self._ref_count += count
+
+    def release(self):
+        with self._ring.lock:
+            assert self._ref_count > 0, self._ref_count
+            self._ref_count -= 1
+
+            if self._ref_count:
+                return
+
+        self._ring.put_free_slot(self)
+
+
+class FrameRing:
+    # Preallocated frame sized buffers that are reused to avoid allocating
+    # a new bytes object for every frame
+    def __init__(self, slot_count: int, slot_size: int):
+        assert slot_count > 0
+        assert slot_size > 0
+
+        self._slot_size = slot_size
+        self._free_slots = queue.Queue()
+        self._log_cooldown_timestamp = 0
+        self.lock = threading.Lock()
+
+        for index in range(slot_count):
+            self._free_slots.put(Frame(self, index, bytearray(slot_size)))
+
+    @property
+    def slot_size(self) -> int:
+        return self._slot_size
+
+    def acquire(self) -> Frame:
+        try:
+            frame = self._free_slots.get_nowait()
+        except queue.Empty:
+            time_now = time.time()
+            if time_now - self._log_cooldown_timestamp > 60:
+                _logger.warning('Frame ring exhausted. Allocating extra '
+                                'frame buffer.')
+                self._log_cooldown_timestamp = time_now
+
+            frame = Frame(self, -1, bytearray(self._slot_size))
+
+        frame.timestamp = None
+        frame.retain()
+
+        return frame
+
+    def put_free_slot(self, frame: Frame):
+        if frame.index >= 0:
+            self._free_slots.put(frame)
@@ -0,0 +1,107 @@
+import logging
+import time
+from typing import Dict
+
+from tppocr.metrics import Metrics
+
+_logger = logging.getLogger(__name__)
+
+
+class AdaptiveFrameRate:
+    # Decimates the frames from ffmpeg, which outputs at max_fps. The rate is
+    # lowered when the OCR queues build up more latency than max_latency and
+    # raised while the recognized text is changing. When idle, the rate
+    # slowly decays to min_fps. The latency of a queue is estimated from
+    # the time its OCR section has recently spent recognizing each frame.
+    DECREASE_FACTOR = 0.5
+    INCREASE_FACTOR = 1.5
+    IDLE_DECAY_FACTOR = 0.9
+
+    def __init__(self, min_fps: float, max_fps: float, max_latency: float=2,
+                 update_interval: float=1, metrics: Metrics=None):
+        assert 0 < min_fps <= max_fps
+        assert max_latency > 0
+
+        self._min_fps = min_fps
+        self._max_fps = max_fps
+        self._max_latency = max_latency
+        self._update_interval = update_interval
+        self._metrics = metrics or Metrics()
+        self._fps = max_fps
+        self._frame_credit = 1.0
+        self._update_timestamp = time.monotonic()
+        self._text_change_count = 0
+        # By consumer name, the recognize time and frame count at the last
+        # update and the estimated OCR time per frame
+        self._recognize_sums = {}
+        self._frame_counts = {}
+        self._frame_durations = {}
+
+        self._metrics.add_gauge('output_fps', lambda: self._fps)
+
+    @property
+    def fps(self) -> float:
+        return self._fps
+
+    def keep_frame(self) -> bool:
+        self._frame_credit += self._fps / self._max_fps
+
+        if self._frame_credit >= 1.0:
+            self._frame_credit -= 1.0
+            return True
+        else:
+            self._metrics.increment('decimated_frames')
+            return False
+
+    def update(self, queue_depths: Dict[str, int]):
+        time_now = time.monotonic()
+
+        if time_now - self._update_timestamp < self._update_interval:
+            return
+
+        self._update_timestamp = time_now
+
+        text_change_count = self._metrics.get_counter('text_changes')
+        text_changed = text_change_count != self._text_change_count
+        self._text_change_count = text_change_count
+
+        # Time for OCR to get through the frames already queued
+        latency = max(
+            (queue_depth * self._update_frame_duration(name)
+             for name, queue_depth in queue_depths.items()),
+            default=0
+        )
+        queue_depth = max(queue_depths.values(), default=0)
+
+        if latency > self._max_latency:
+            fps = self._fps * self.DECREASE_FACTOR
+        elif queue_depth:
+            fps = self._fps
+        elif text_changed:
+            fps = self._fps * self.INCREASE_FACTOR
+        else:
+            fps = self._fps * self.IDLE_DECAY_FACTOR
+
+        fps = min(self._max_fps, max(self._min_fps, fps))
+
+        if fps != self._fps:
+            _logger.debug('Output FPS %.2f (latency %.2f, queue depth %d, '
+                          'text changed %s)',
+                          fps, latency, queue_depth, text_changed)
+            self._fps = fps
+
+    def _update_frame_duration(self, name: str) -> float:
+        recognize_sum = self._metrics.get_histogram_sum(
+            'recognize.{}'.format(name))
+        frame_count = self._metrics.get_counter('frames.{}'.format(name))
+        new_frame_count = frame_count - self._frame_counts.get(name, 0)
+
+        # Keep the last estimate while OCR is stuck on a frame
+        if new_frame_count:
+            self._frame_durations[name] = \
+                (recognize_sum - self._recognize_sums.get(name, 0.0)) / \
+                new_frame_count
+            self._recognize_sums[name] = recognize_sum
+            self._frame_counts[name] = frame_count
+
+        return self._frame_durations.get(name, 0.0)
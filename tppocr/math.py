@@ -1,4 +1,5 @@
 import collections
+from typing import Iterable
 
 RectangleTuple = collections.namedtuple(
     'RectangleTuple',
@@ -9,3 +10,16 @@ Size2DTuple = collections.namedtuple(
     'Size2DTuple',
     ['width', 'height']
 )
+
+
+def union_rectangle(rects: Iterable[RectangleTuple]) -> RectangleTuple:
+    rects = tuple(rects)
+
+    assert rects
+
+    return RectangleTuple(
+        min(rect.x1 for rect in rects),
+        min(rect.y1 for rect in rects),
+        max(rect.x2 for rect in rects),
+        max(rect.y2 for rect in rects),
+    )
@@ -0,0 +1,126 @@
+import bisect
+import collections
+import contextlib
+import logging
+import threading
+import time
+from typing import Callable, Sequence
+
+_logger = logging.getLogger(__name__)
+
+# Upper bounds in seconds
+DEFAULT_HISTOGRAM_BOUNDS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10
+)
+
+
+class Histogram:
+    def __init__(self, bounds: Sequence[float]=DEFAULT_HISTOGRAM_BOUNDS):
+        self._bounds = tuple(bounds)
+        # The last bucket counts values larger than all the bounds
+        self._bucket_counts = [0] * (len(self._bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float):
+        self._bucket_counts[bisect.bisect_left(self._bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def to_dict(self) -> dict:
+        return {
+            'count': self.count,
+            'sum': self.sum,
+            'mean': self.sum / self.count if self.count else 0.0,
+            'max': self.max,
+            'bounds': self._bounds,
+            'buckets': list(self._bucket_counts),
+        }
+
+
+class Metrics:
+    # Counters, histograms and gauges shared by the pipeline threads.
+    # Gauges are functions sampled when a snapshot is taken.
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = collections.Counter()
+        self._histograms = {}
+        self._gauges = {}
+        self._start_timestamp = time.time()
+
+    def increment(self, name: str, amount: int=1):
+        with self._lock:
+            self._counters[name] += amount
+
+    def get_counter(self, name: str) -> int:
+        with self._lock:
+            return self._counters[name]
+
+    def get_histogram_sum(self, name: str) -> float:
+        with self._lock:
+            histogram = self._histograms.get(name)
+            return histogram.sum if histogram else 0.0
+
+    def observe(self, name: str, value: float):
+        with self._lock:
+            histogram = self._histograms.get(name)
+
+            if not histogram:
+                histogram = self._histograms[name] = Histogram()
+
+            histogram.observe(value)
+
+    @contextlib.contextmanager
+    def measure(self, name: str):
+        start_time = time.perf_counter()
+
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start_time)
+
+    def add_gauge(self, name: str, func: Callable[[], float]):
+        self._gauges[name] = func
+
+    def snapshot(self) -> dict:
+        gauges = dict((name, func()) for name, func in self._gauges.items())
+
+        with self._lock:
+            return {
+                'uptime': time.time() - self._start_timestamp,
+                'counters': dict(self._counters),
+                'histograms': dict(
+                    (name, histogram.to_dict())
+                    for name, histogram in self._histograms.items()
+                ),
+                'gauges': gauges,
+            }
+
+
+class MetricsPublisher(threading.Thread):
+    # Periodically passes a metrics document to publish_doc
+    def __init__(self, metrics: Metrics, publish_doc: Callable[[dict], None],
+                 interval: float=60):
+        super().__init__(daemon=True)
+        self._metrics = metrics
+        self._publish_doc = publish_doc
+        self._interval = interval
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self._interval):
+            self.publish()
+
+    def stop(self):
+        self._stop_event.set()
+
+    def publish(self):
+        doc = {
+            'type': 'metrics',
+            'metrics': self._metrics.snapshot(),
+            'timestamp': time.time(),
+        }
+
+        self._publish_doc(doc)
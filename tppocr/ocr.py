@@ -2,8 +2,10 @@ import cProfile
 import logging
 import os
 import queue
-from typing import Tuple
+from typing import Tuple, List, Optional, Any
 import io
+import bisect
+import collections
 
 import tesserocr
 import PIL.Image
@@ -14,19 +16,34 @@ import PIL.ImageOps
 import PIL.ImageMath
 import PIL.ImageEnhance
 import itertools
+import time
 
-from tppocr.math import RectangleTuple
+from tppocr.change import FrameChangeDetector
+from tppocr.frame import Frame, FrameGeometry
+from tppocr.math import RectangleTuple, Size2DTuple
+from tppocr.metrics import Metrics
+from tppocr.preprocess import new_preprocessor
 from tppocr.stream import BaseStream
-from tppocr.text import TextFilter
+from tppocr.tesseract import TesseractAPIPool
+from tppocr.text import TextFilter, RecognizedLine
+from tppocr.viewers import ViewerMonitor
 
 _logger = logging.getLogger(__name__)
 
+RecognitionResult = collections.namedtuple(
+    'RecognitionResult',
+    ['text', 'confidence', 'image', 'ocr_image', 'text_line_boxes', 'lines']
+)
+
 
 class RegionInfo:
     def __init__(self):
         self.computed_ocr_region = None
         self.scale_factor = None
         self.computed_ocr_image_white_region = None
+        self.computed_ocr_image_line_rectangles = None
+        self.resized_size = None
+        self.preprocess_data = None
 
 
 class OCRConfig:
@@ -43,17 +60,49 @@ class OCRConfig:
         self.section_name = '[default]'
         self.fps = None
         self.clear_adaptive_classifier = False
+        self.page_segmentation_mode = tesserocr.PSM.AUTO
+        # The top and bottom of each line of text in the region, in the same
+        # coordinates as the region. Each line is recognized on its own
+        # without Tesseract's layout analysis.
+        self.line_layout = None
+        self.change_threshold = None
+        self.batch_size = 1
+        self.preprocess_engine = 'pil'
+        self.debug_image_interval = 2
+        self.debug_image_scale = 1.0
+        self.debug_image_quality = 75
 
 
 class OCR:
     MIN_OCR_IMAGE_HEIGHT = 200
+    BATCH_SEPARATOR_HEIGHT = 20
 
     def __init__(self, stream: BaseStream, config: OCRConfig,
-                 text_filter: TextFilter, frame_queue: queue.Queue):
+                 text_filter: TextFilter, frame_queue: queue.Queue,
+                 metrics: Metrics=None, viewer_monitor: ViewerMonitor=None,
+                 api_pool: TesseractAPIPool=None):
         self._stream = stream
         self._config = config
         self._text_filter = text_filter
         self._frame_queue = frame_queue
+        self._metrics = metrics or Metrics()
+        self._viewer_monitor = viewer_monitor
+        # Shared with other sections. Otherwise, OCR starts its own API.
+        self._api_pool = api_pool
+        self._debug_image_timestamp = 0
+
+        self._region_info = None
+        self._region_info_geometry = None
+        # A frame with a different geometry than the rest of the batch
+        self._pending_frame = None
+        self._preprocessor = new_preprocessor(
+            config.preprocess_engine, config.text_drop_shadow_filter
+        )
+
+        if config.change_threshold is not None:
+            self._change_detector = FrameChangeDetector(config.change_threshold)
+        else:
+            self._change_detector = None
 
     def run(self):
         # profiler = cProfile.Profile()
@@ -62,90 +111,119 @@ class OCR:
         # profiler.disable()
         # profiler.dump_stats('stat.dat')
 
-    def _prime_frame_queue(self):
-        self._frame_queue.get()
-        _logger.debug('Video size %s', self._stream.frame_size)
+    def _get_metric_name(self, name: str) -> str:
+        return '{}.{}'.format(name, self._config.section_name)
+
+    def _get_computed_rectangle(self, rect: RectangleTuple,
+                                geometry: FrameGeometry) -> RectangleTuple:
+        frame_size, (source_width, source_height), crop_rect = geometry
+        scale_x = frame_size.width / (crop_rect.x2 - crop_rect.x1)
+        scale_y = frame_size.height / (crop_rect.y2 - crop_rect.y1)
 
-    def _get_computed_rectangle(self, rect: RectangleTuple) -> RectangleTuple:
-        x1 = int(self._stream.frame_size[0] * rect.x1)
-        y1 = int(self._stream.frame_size[1] * rect.y1)
-        x2 = int(self._stream.frame_size[0] * rect.x2)
-        y2 = int(self._stream.frame_size[1] * rect.y2)
+        # Translate from the source video into the cropped sub-frame
+        x1 = int((int(source_width * rect.x1) - crop_rect.x1) * scale_x)
+        y1 = int((int(source_height * rect.y1) - crop_rect.y1) * scale_y)
+        x2 = int((int(source_width * rect.x2) - crop_rect.x1) * scale_x)
+        y2 = int((int(source_height * rect.y2) - crop_rect.y1) * scale_y)
 
-        assert x1 < x2
-        assert y1 < y2
+        assert 0 <= x1 < x2 <= frame_size.width
+        assert 0 <= y1 < y2 <= frame_size.height
 
         return RectangleTuple(x1, y1, x2, y2)
 
-    def _get_computed_cropping_params(self, rect: RectangleTuple) -> \
+    def _get_computed_cropping_params(self, rect: RectangleTuple,
+                                      geometry: FrameGeometry) -> \
             Tuple[RectangleTuple, float]:
-        rect = self._get_computed_rectangle(rect)
+        rect = self._get_computed_rectangle(rect, geometry)
         height = rect.y2 - rect.y1
         scale_factor = max(1, self.MIN_OCR_IMAGE_HEIGHT / height)
 
         return rect, scale_factor
 
-    def _compute_regions(self) -> RegionInfo:
+    def _compute_regions(self, geometry: FrameGeometry) -> RegionInfo:
         info = RegionInfo()
         computed_ocr_region, scale_factor = self._get_computed_cropping_params(
-            self._config.region
+            self._config.region, geometry
         )
         info.computed_ocr_region = computed_ocr_region
         info.scale_factor = scale_factor
 
-        if self._config.white_region:
-            computed_white_region = self._get_computed_rectangle(
-                self._config.white_region
-            )
+        width = computed_ocr_region.x2 - computed_ocr_region.x1
+        height = computed_ocr_region.y2 - computed_ocr_region.y1
+        info.resized_size = Size2DTuple(
+            int(width * scale_factor), int(height * scale_factor)
+        )
+        info.preprocess_data = self._preprocessor.prepare(
+            Size2DTuple(width, height), info.resized_size
+        )
 
+        if self._config.white_region:
             assert self._config.region.x1 <= self._config.white_region.x1 < self._config.white_region.x2 <= self._config.region.x2
             assert self._config.region.y1 <= self._config.white_region.y1 < self._config.white_region.y2 <= self._config.region.y2
 
-            x1 = (computed_white_region.x1 - computed_ocr_region.x1) \
-                * scale_factor
-            y1 = (computed_white_region.y1 - computed_ocr_region.y1) \
-                * scale_factor
-            x2 = (computed_white_region.x2 - computed_ocr_region.x1) \
-                * scale_factor
-            y2 = (computed_white_region.y2 - computed_ocr_region.y1) \
-                * scale_factor
-
-            info.computed_ocr_image_white_region = RectangleTuple(
-                int(x1), int(y1), int(x2), int(y2),
-            )
+            info.computed_ocr_image_white_region = \
+                self._get_computed_ocr_image_rectangle(
+                    self._config.white_region, geometry, info
+                )
         else:
             info.computed_ocr_image_white_region = None
 
+        if self._config.line_layout:
+            info.computed_ocr_image_line_rectangles = list(
+                self._get_computed_ocr_image_rectangle(
+                    RectangleTuple(self._config.region.x1, y1,
+                                   self._config.region.x2, y2),
+                    geometry, info
+                )
+                for y1, y2 in self._config.line_layout
+            )
+        else:
+            info.computed_ocr_image_line_rectangles = None
+
         return info
 
-    def _preprocess_image(self, frame_data: bytes, region_info: RegionInfo) -> \
-            PIL.Image.Image:
-        region = region_info.computed_ocr_region
+    def _get_computed_ocr_image_rectangle(
+            self, rect: RectangleTuple, geometry: FrameGeometry,
+            region_info: RegionInfo) -> RectangleTuple:
+        # Translate from the source video into the preprocessed OCR image
+        computed_rect = self._get_computed_rectangle(rect, geometry)
+        computed_ocr_region = region_info.computed_ocr_region
         scale_factor = region_info.scale_factor
-        x1, y1, x2, y2 = region
-        width = x2 - x1
-        height = y2 - y1
 
-        assert width > 0
-        assert height > 0
+        x1 = (computed_rect.x1 - computed_ocr_region.x1) * scale_factor
+        y1 = (computed_rect.y1 - computed_ocr_region.y1) * scale_factor
+        x2 = (computed_rect.x2 - computed_ocr_region.x1) * scale_factor
+        y2 = (computed_rect.y2 - computed_ocr_region.y1) * scale_factor
 
-        _logger.debug('ORC cropping to %s,%s %sx%s (scale %s)', x1, y1, width,
-                      height, scale_factor)
+        return RectangleTuple(int(x1), int(y1), int(x2), int(y2))
 
-        image = PIL.Image.frombytes('L', self._stream.frame_size, frame_data)
+    def _get_region_info(self, geometry: FrameGeometry) -> RegionInfo:
+        if geometry != self._region_info_geometry:
+            if self._region_info_geometry:
+                _logger.info('Section %s frame size changed to %s',
+                             self._config.section_name, geometry.frame_size)
 
-        image = image.crop((x1, y1, x2, y2))
-        image = PIL.ImageOps.autocontrast(image)
+            self._region_info = region_info = self._compute_regions(geometry)
+            self._region_info_geometry = geometry
 
-        image = image.resize(
-            (int(width * scale_factor), int(height * scale_factor)),
-            resample=PIL.Image.BILINEAR
-        )
+            x1, y1, x2, y2 = region_info.computed_ocr_region
+            _logger.debug('ORC cropping to %s,%s %sx%s (scale %s)', x1, y1,
+                          x2 - x1, y2 - y1, region_info.scale_factor)
 
-        if self._config.text_drop_shadow_filter:
-            image = image.point(lambda i: 255 if i > 100 else i)
+        return self._region_info
+
+    def _crop_frame(self, frame_data: memoryview, frame_size: Size2DTuple,
+                    region_info: RegionInfo) -> Any:
+        return self._preprocessor.crop_frame(
+            frame_data, frame_size, region_info.computed_ocr_region
+        )
 
-        return image
+    def _preprocess_image(self, cropped_image: Any,
+                          region_info: RegionInfo) -> PIL.Image.Image:
+        return self._preprocessor.preprocess(
+            cropped_image, region_info.resized_size,
+            region_info.preprocess_data
+        )
 
     def _compute_white_region_confidence(
             self, ocr_image: PIL.Image.Image, region_info: RegionInfo,
@@ -153,6 +231,14 @@ class OCR:
         if not region_info.computed_ocr_image_white_region:
             return 100
 
+        with self._metrics.measure(
+                self._get_metric_name('white_region_confidence')):
+            return self._compute_white_region_confidence_stat(
+                ocr_image, region_info, nonwhite_pixel_count_threshold)
+
+    def _compute_white_region_confidence_stat(
+            self, ocr_image: PIL.Image.Image, region_info: RegionInfo,
+            nonwhite_pixel_count_threshold: int) -> int:
         image = ocr_image.crop(region_info.computed_ocr_image_white_region)
 
         stat = PIL.ImageStat.Stat(image)
@@ -173,10 +259,10 @@ class OCR:
         else:
             return 100 if nonwhite_pixel_count == 0 else 0
 
-    def _render_debug_image(self, source_image: PIL.Image.Image,
-                            ocr_image: PIL.Image.Image,
-                            api: tesserocr.PyTessBaseAPI,
+    def _render_debug_image(self, result: RecognitionResult,
                             region_info: RegionInfo) -> PIL.Image.Image:
+        source_image = result.image
+        ocr_image = result.ocr_image
         debug_image_width = max(source_image.width, ocr_image.width)
         debug_image_height = source_image.height + ocr_image.height
         debug_image = PIL.Image.new(
@@ -188,12 +274,12 @@ class OCR:
 
         draw_context = PIL.ImageDraw.Draw(debug_image)
 
-        for box_image, box, block_id, para_id in api.GetTextlines():
-            x = box['x']
-            y = box['y'] + source_image.height
-            w = box['w']
-            h = box['h']
-            draw_context.rectangle((x, y, x + w, y + h), outline=127)
+        # A reused result from before debug images were due has no boxes
+        for x1, y1, x2, y2 in result.text_line_boxes or ():
+            draw_context.rectangle(
+                (x1, y1 + source_image.height, x2, y2 + source_image.height),
+                outline=127
+            )
 
         if region_info.computed_ocr_image_white_region:
             draw_context.rectangle((
@@ -203,63 +289,371 @@ class OCR:
                 region_info.computed_ocr_image_white_region.y2 + source_image.height
             ), outline=220)
 
+        if self._config.debug_image_scale != 1.0:
+            debug_image = debug_image.resize((
+                max(1, int(debug_image.width * self._config.debug_image_scale)),
+                max(1, int(debug_image.height * self._config.debug_image_scale))
+            ), resample=PIL.Image.BILINEAR)
+
         return debug_image
 
     def _run(self):
         self._check_tessdir()
-        self._prime_frame_queue()
 
-        with tesserocr.PyTessBaseAPI(lang=self._config.language) as api:
-            api.SetVariable("tessedit_write_images", "T")
+        api_pool = self._api_pool or TesseractAPIPool()
+
+        try:
+            self._run_frames(api_pool)
+        finally:
+            if api_pool is not self._api_pool:
+                api_pool.close()
+
+        _logger.info('Tesseract quit')
+
+    def _run_frames(self, api_pool: TesseractAPIPool):
+        if self._config.clear_adaptive_classifier:
+            _logger.info('Clearing adaptive classifier after each run')
+
+        if self._change_detector:
+            _logger.info('Skipping OCR on unchanged frames')
+
+        if self._config.line_layout:
+            _logger.info('Recognizing %d lines at fixed positions',
+                         len(self._config.line_layout))
+
+        if self._config.batch_size > 1:
+            _logger.info('Recognizing up to %d queued frames at once',
+                         self._config.batch_size)
+
+        result = None
+        timestamp = None
+        counter = 0
+        running = True
+
+        while running:
+            frames = self._get_frames()
+
+            if frames[-1] is None:
+                frames.pop()
+                running = False
+
+            if not frames:
+                break
+
+            # Frames in a batch have the same geometry
+            geometry = frames[0].geometry
+            region_info = self._get_region_info(geometry)
+            source_images = []
+            timestamps = list(frame.timestamp for frame in frames)
+
+            for frame in frames:
+                with self._metrics.measure(self._get_metric_name('crop')):
+                    source_images.append(self._crop_frame(
+                        frame.data, geometry.frame_size, region_info
+                    ))
+                frame.release()
+
+            changed_indexes = list(
+                index for index, source_image in enumerate(source_images)
+                if not self._change_detector or
+                self._change_detector.feed_image(
+                    self._preprocessor.to_image(source_image))
+            )
+            images = []
+
+            for index in changed_indexes:
+                with self._metrics.measure(
+                        self._get_metric_name('preprocess')):
+                    images.append(self._preprocess_image(
+                        source_images[index], region_info
+                    ))
+
+            self._metrics.increment(self._get_metric_name('frames'),
+                                    len(frames))
+            self._metrics.increment(
+                self._get_metric_name('unchanged_frames'),
+                len(frames) - len(images)
+            )
+
+            debug_image_due = self._is_debug_image_due()
+
+            if images:
+                results = self._recognize_images(
+                    api_pool, images, region_info, debug_image_due
+                )
+            else:
+                results = []
+
+            changed_results = dict(zip(changed_indexes, results))
+
+            for index in range(len(frames)):
+                timestamp = timestamps[index]
+
+                if index in changed_results:
+                    result = changed_results[index]
+                else:
+                    _logger.debug('Frame unchanged, reusing text')
+
+                if result.text and result.lines is not None:
+                    self._text_filter.feed_lines(
+                        result.lines, confidence=result.confidence,
+                        section=self._config.section_name,
+                        timestamp=timestamp)
+                elif result.text:
+                    self._text_filter.feed_text(
+                        result.text, confidence=result.confidence,
+                        section=self._config.section_name,
+                        timestamp=timestamp)
+                else:
+                    self._text_filter.flush_text(timestamp=timestamp)
+
+                if self._change_detector and \
+                        counter % (self._config.fps * 60) == 0:
+                    _logger.info(
+                        'Section %s skipped %d of %d frames (%.0f%%)',
+                        self._config.section_name,
+                        self._change_detector.skipped_frame_count,
+                        self._change_detector.frame_count,
+                        self._change_detector.skip_rate * 100
+                    )
+
+                counter += 1
+
+            if debug_image_due:
+                debug_image = self._render_debug_image(result, region_info)
+                self._text_filter.feed_image(
+                    debug_image, section=self._config.section_name,
+                    quality=self._config.debug_image_quality
+                )
+
+        self._text_filter.flush_text(0, timestamp)
+
+    def _recognize_images(self, api_pool: TesseractAPIPool,
+                          images: List[PIL.Image.Image],
+                          region_info: RegionInfo,
+                          debug_image_due: bool) -> List[RecognitionResult]:
+        if self._config.line_layout:
+            psm = tesserocr.PSM.SINGLE_LINE
+        else:
+            psm = self._config.page_segmentation_mode
+
+        # The API may be used by other sections once it is checked in, so
+        # everything that needs it is taken before then
+        with api_pool.acquire(
+                self._config.language, self._config.tesseract_variables,
+                psm, owner=self, clear_adaptive_classifier=
+                self._config.clear_adaptive_classifier) as api:
+            if self._config.line_layout:
+                return list(
+                    self._recognize_lines(api, image, region_info)
+                    for image in images
+                )
+            elif len(images) > 1:
+                _logger.debug('Recognizing %d frames at once', len(images))
+                return self._recognize_stacked_images(
+                    api, images, region_info
+                )
+
+            result = self._recognize_image(api, images[0], region_info)
+
+            if debug_image_due:
+                result = result._replace(
+                    text_line_boxes=self._get_text_line_boxes(api)
+                )
+
+            return [result]
+
+    @classmethod
+    def _get_text_line_boxes(cls, api: tesserocr.PyTessBaseAPI) \
+            -> List[RectangleTuple]:
+        return list(
+            RectangleTuple(box['x'], box['y'],
+                           box['x'] + box['w'], box['y'] + box['h'])
+            for box_image, box, block_id, para_id in api.GetTextlines()
+        )
+
+    def _is_debug_image_due(self) -> bool:
+        time_now = time.monotonic()
+
+        if time_now - self._debug_image_timestamp < \
+                self._config.debug_image_interval:
+            return False
+
+        self._debug_image_timestamp = time_now
+
+        # Don't pay for drawing and encoding images that no one is watching
+        return not self._viewer_monitor or \
+            self._viewer_monitor.has_viewers(self._config.section_name)
+
+    def _get_frames(self) -> List[Optional[Frame]]:
+        if self._pending_frame:
+            frames = [self._pending_frame]
+            self._pending_frame = None
+        else:
+            with self._metrics.measure(self._get_metric_name('queue_wait')):
+                frames = [self._frame_queue.get()]
+
+        # Catch up by taking the frames that are already waiting
+        while frames[-1] and len(frames) < self._config.batch_size and \
+                self._frame_queue.qsize():
+            frame = self._frame_queue.get()
+
+            if frame and frame.geometry != frames[0].geometry:
+                self._pending_frame = frame
+                break
 
-            for key, value in self._config.tesseract_variables.items():
-                _logger.info('Setting tesseract variable %s=%s', key, value)
-                api.SetVariable(key, value)
+            frames.append(frame)
 
-            if self._config.clear_adaptive_classifier:
-                _logger.info('Clearing adaptive classifier after each run')
+        return frames
 
-            for counter in itertools.count():
-                frame_data = self._frame_queue.get()
+    def _recognize_image(self, api: tesserocr.PyTessBaseAPI,
+                         image: PIL.Image.Image, region_info: RegionInfo) -> \
+            RecognitionResult:
+        assert image.mode == 'L'
+        api.SetImageBytes(image.tobytes(),
+                          image.width, image.height, 1, image.width)
 
-                if not frame_data:
-                    break
+        with self._metrics.measure(self._get_metric_name('recognize')):
+            text = api.GetUTF8Text().strip()
 
-                region_info = self._compute_regions()
-                image = self._preprocess_image(frame_data, region_info)
+        ocr_image = api.GetThresholdedImage()
 
-                assert image.mode == 'L'
-                api.SetImageBytes(bytes(image.getdata(0)),
-                                  image.width, image.height, 1, image.width)
+        if text:
+            confidence = api.MeanTextConf()
+            white_confidence = self._compute_white_region_confidence(
+                ocr_image, region_info)
+            confidence -= 100 - white_confidence
+            confidence = max(0, confidence)
+        else:
+            confidence = 0
+
+        return RecognitionResult(text, confidence, image, ocr_image, None,
+                                 None)
+
+    def _recognize_lines(self, api: tesserocr.PyTessBaseAPI,
+                         image: PIL.Image.Image, region_info: RegionInfo) -> \
+            RecognitionResult:
+        # The API is in single line mode. Each line of the layout is
+        # recognized by restricting the same image to its rectangle.
+        assert image.mode == 'L'
+        api.SetImageBytes(image.tobytes(),
+                          image.width, image.height, 1, image.width)
 
+        if region_info.computed_ocr_image_white_region:
+            # Taken before a rectangle is set so it is of the whole image
+            ocr_image = api.GetThresholdedImage()
+            white_confidence = self._compute_white_region_confidence(
+                ocr_image, region_info)
+        else:
+            # Put together from the lines, which are already thresholded
+            # for recognition, instead of thresholding the image again
+            ocr_image = PIL.Image.new('L', image.size, 255)
+            white_confidence = 100
+
+        lines = []
+
+        with self._metrics.measure(self._get_metric_name('recognize')):
+            for x1, y1, x2, y2 in \
+                    region_info.computed_ocr_image_line_rectangles:
+                api.SetRectangle(x1, y1, x2 - x1, y2 - y1)
                 text = api.GetUTF8Text().strip()
-                ocr_image = api.GetThresholdedImage()
 
                 if text:
                     confidence = api.MeanTextConf()
-                    white_confidence = self._compute_white_region_confidence(
-                        ocr_image, region_info)
                     confidence -= 100 - white_confidence
                     confidence = max(0, confidence)
-                    self._text_filter.feed_text(
-                        text, confidence=confidence,
-                        section=self._config.section_name)
                 else:
-                    self._text_filter.flush_text()
+                    confidence = 0
 
-                if counter % (self._config.fps * 2) == 0:
-                    debug_image = self._render_debug_image(
-                        image, ocr_image, api, region_info
-                    )
-                    self._text_filter.feed_image(
-                        debug_image, section=self._config.section_name
-                    )
+                lines.append(RecognizedLine(text, confidence))
 
-                if self._config.clear_adaptive_classifier:
-                    api.ClearAdaptiveClassifier()
+                if not region_info.computed_ocr_image_white_region:
+                    ocr_image.paste(api.GetThresholdedImage(), (x1, y1))
 
-        self._text_filter.flush_text(0)
-        _logger.info('Tesseract quit')
+        confidences = list(line.confidence for line in lines if line.text)
+
+        if confidences:
+            confidence = int(sum(confidences) / len(confidences))
+        else:
+            confidence = 0
+
+        return RecognitionResult(
+            '\n'.join(line.text for line in lines if line.text), confidence,
+            image, ocr_image, region_info.computed_ocr_image_line_rectangles,
+            lines
+        )
+
+    def _recognize_stacked_images(self, api: tesserocr.PyTessBaseAPI,
+                                  images: List[PIL.Image.Image],
+                                  region_info: RegionInfo) -> \
+            List[RecognitionResult]:
+        # Stack the images vertically with blank rows between them so a
+        # single Tesseract call recognizes all of them. The text lines are
+        # assigned back to the images by their position.
+        width = max(image.width for image in images)
+        height = sum(image.height for image in images) + \
+            self.BATCH_SEPARATOR_HEIGHT * (len(images) - 1)
+        stacked_image = PIL.Image.new('L', (width, height), 255)
+        offsets = []
+        y = 0
+
+        for image in images:
+            stacked_image.paste(image, (0, y))
+            offsets.append(y)
+            y += image.height + self.BATCH_SEPARATOR_HEIGHT
+
+        api.SetImageBytes(stacked_image.tobytes(),
+                          stacked_image.width, stacked_image.height,
+                          1, stacked_image.width)
+
+        with self._metrics.measure(self._get_metric_name('recognize')):
+            api.Recognize()
+
+        stacked_ocr_image = api.GetThresholdedImage()
+
+        line_texts = list([] for dummy in images)
+        line_confidences = list([] for dummy in images)
+        line_boxes = list([] for dummy in images)
+        iterator = api.GetIterator()
+
+        if iterator:
+            level = tesserocr.RIL.TEXTLINE
+
+            for line in tesserocr.iterate_level(iterator, level):
+                x1, y1, x2, y2 = line.BoundingBox(level)
+                index = bisect.bisect_right(offsets, (y1 + y2) / 2) - 1
+                offset = offsets[index]
+
+                line_texts[index].append(line.GetUTF8Text(level))
+                line_confidences[index].append(line.Confidence(level))
+                line_boxes[index].append(
+                    RectangleTuple(x1, y1 - offset, x2, y2 - offset)
+                )
+
+        results = []
+
+        for index, image in enumerate(images):
+            offset = offsets[index]
+            ocr_image = stacked_ocr_image.crop(
+                (0, offset, image.width, offset + image.height)
+            )
+            text = ''.join(line_texts[index]).strip()
+
+            if text:
+                confidences = line_confidences[index]
+                confidence = int(sum(confidences) / len(confidences))
+                white_confidence = self._compute_white_region_confidence(
+                    ocr_image, region_info)
+                confidence -= 100 - white_confidence
+                confidence = max(0, confidence)
+            else:
+                confidence = 0
+
+            results.append(RecognitionResult(
+                text, confidence, image, ocr_image, line_boxes[index], None
+            ))
+
+        return results
 
     def _check_tessdir(self):
         tess_dir = os.environ.get('TESSDATA_PREFIX', '/usr/share/tesseract-ocr/')
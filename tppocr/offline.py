@@ -0,0 +1,276 @@
+import argparse
+import collections
+import functools
+import logging
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from typing import Dict, Iterable, List, Optional
+
+from tppocr.__main__ import get_ocr_section_keys, new_ocr_config, \
+    get_source_input, get_stream_crop, read_config, OCR_SECTION_PREFIX
+from tppocr.ocr import OCR
+from tppocr.queue import ConsumerBroadcastQueue
+from tppocr.similarity import is_similar
+from tppocr.stream import FFmpegDecoder, URLStream, get_video_duration
+from tppocr.text import TextFilter, DEFAULT_TEXT_BUFFER_TIME
+from tppocr.wire import encode_json
+
+_logger = logging.getLogger(__name__)
+
+FRAME_QUEUE_SIZE = 5
+
+# The part of the video whose text belongs to the segment and the
+# part that is decoded. The decoded part overlaps the neighbouring segments
+# so text blocks that cross the boundaries are seen whole by one segment.
+Segment = collections.namedtuple(
+    'Segment', ['index', 'start', 'end', 'decode_start', 'decode_end']
+)
+
+
+class SegmentStream(URLStream):
+    # Decodes part of a local video without dropping frames. Frames are
+    # timestamped by their position in the video. Since ffmpeg outputs a
+    # constant frame rate from the seek position, the position is computed
+    # from the frame number.
+    def __init__(self, url: str, start: float, duration: float, **kwargs):
+        super().__init__(url, lossless=True, **kwargs)
+        self._start = start
+        self._duration = duration
+
+    def _get_frame_timestamp(self, frame_number: int) -> Optional[float]:
+        return self._start + frame_number / self._output_fps
+
+    def _get_ffmpeg_args(self) -> List[str]:
+        args = super()._get_ffmpeg_args()
+        args[1:1] = ['-ss', str(self._start), '-t', str(self._duration)]
+
+        return args
+
+    def _try_start_decoder(self) -> FFmpegDecoder:
+        # Retrying won't help with a local file, so the error fails the
+        # segment
+        return self._start_decoder()
+
+
+class OfflineTextFilter(TextFilter):
+    # Collects the output text instead of publishing it
+    def __init__(self):
+        super().__init__(None)
+        self.docs = []
+
+    def feed_image(self, *args, **kwargs):
+        pass
+
+    def _publish_raw_text(self, *args, **kwargs):
+        pass
+
+    def _publish_text(self, text: str, timestamp: float=None,
+                      section: str=None):
+        self.docs.append({
+            'type': 'output_text',
+            'text': text,
+            'timestamp': timestamp,
+            'section': section
+        })
+
+
+def get_segments(duration: float, segment_duration: float,
+                 overlap: float) -> Iterable[Segment]:
+    start = 0
+    index = 0
+
+    while start < duration:
+        end = min(duration, start + segment_duration)
+
+        yield Segment(index, start, end, max(0, start - overlap),
+                      min(duration, end + overlap))
+
+        start = end
+        index += 1
+
+
+def ocr_segment(config_filename: str, segment: Segment) -> List[dict]:
+    config = read_config(config_filename)
+    ocr_section_keys = tuple(get_ocr_section_keys(config))
+    crop_region, crop_scale = get_stream_crop(config)
+    ocr_configs = list(
+        new_ocr_config(config, key) for key in ocr_section_keys
+    )
+
+    # Frames wait in the stream queue, each consumer queue and each OCR
+    # batch
+    frame_buffer_count = FRAME_QUEUE_SIZE + 2 + sum(
+        FRAME_QUEUE_SIZE + ocr_config.batch_size for ocr_config in ocr_configs
+    )
+    stream = SegmentStream(
+        get_source_input(config, config_filename),
+        segment.decode_start, segment.decode_end - segment.decode_start,
+        output_fps=config['source'].getfloat('process_output_fps'),
+        frame_queue=queue.Queue(FRAME_QUEUE_SIZE),
+        crop_region=crop_region, crop_scale=crop_scale,
+        frame_buffer_count=frame_buffer_count
+    )
+    consumer_broadcast_queue = ConsumerBroadcastQueue(
+        stream.frame_queue, len(ocr_section_keys), FRAME_QUEUE_SIZE,
+        consumer_names=tuple(
+            key[len(OCR_SECTION_PREFIX):] for key in ocr_section_keys
+        ),
+        lossless=True
+    )
+    text_filters = []
+    errors = []
+    threads = [
+        consumer_broadcast_queue,
+        threading.Thread(target=_run_stream, args=(stream, errors),
+                         daemon=True),
+    ]
+
+    for ocr_config, frame_queue in \
+            zip(ocr_configs, consumer_broadcast_queue.consumer_queues):
+        # No one watches debug images
+        ocr_config.debug_image_interval = float('inf')
+        text_filter = OfflineTextFilter()
+        text_filters.append(text_filter)
+        ocr = OCR(stream, ocr_config, text_filter, frame_queue)
+        threads.append(threading.Thread(
+            target=_run_ocr, args=(ocr, frame_queue, errors), daemon=True
+        ))
+
+    for thread in threads:
+        thread.start()
+
+    for thread in threads:
+        thread.join()
+
+    if errors:
+        raise errors[0]
+
+    docs = list(
+        doc for text_filter in text_filters for doc in text_filter.docs
+        if segment.start <= doc['timestamp'] < segment.end
+    )
+    docs.sort(key=lambda doc: doc['timestamp'])
+
+    return docs
+
+
+def _run_stream(stream: SegmentStream, errors: List[Exception]):
+    try:
+        stream.run()
+    except Exception as error:
+        _logger.exception('Stream failed')
+        errors.append(error)
+        # Ends the frame queues so the OCR threads finish
+        stream.stop()
+
+
+def _run_ocr(ocr: OCR, frame_queue: queue.Queue, errors: List[Exception]):
+    try:
+        ocr.run()
+    except Exception as error:
+        _logger.exception('OCR failed')
+        errors.append(error)
+
+        # Keep taking frames so the lossless queues don't block the stream
+        while True:
+            frame = frame_queue.get()
+
+            if not frame:
+                break
+
+            frame.release()
+
+
+def stitch_segment(docs: List[dict], last_docs: Dict[str, dict],
+                   overlap: float) -> List[dict]:
+    # A block that was still on screen at a boundary can be output by both
+    # segments with slightly different start times. Skip the repeat at the
+    # start of a segment.
+    stitched_docs = []
+    seen_sections = set()
+
+    for doc in docs:
+        section = doc['section']
+        last_doc = last_docs.get(section)
+
+        if section not in seen_sections and last_doc and \
+                doc['timestamp'] - last_doc['timestamp'] < overlap and \
+                is_similar(doc['text'], last_doc['text'], 0.9):
+            _logger.debug('Skipped repeated text %s', ascii(doc['text']))
+            continue
+
+        seen_sections.add(section)
+        last_docs[section] = doc
+        stitched_docs.append(doc)
+
+    return stitched_docs
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(
+        description='OCR a local video file as fast as possible'
+    )
+    arg_parser.add_argument('config_file')
+    arg_parser.add_argument('output_file',
+                            help='File to write the output text as JSON lines')
+    arg_parser.add_argument('--jobs', type=int, default=os.cpu_count(),
+                            help='Number of segments to OCR at once')
+    arg_parser.add_argument('--segment-duration', type=float, default=300,
+                            help='Seconds of video in each segment')
+    arg_parser.add_argument('--overlap', type=float,
+                            default=DEFAULT_TEXT_BUFFER_TIME * 2,
+                            help='Seconds decoded past each segment boundary')
+    arg_parser.add_argument('--time-offset', type=float, default=0,
+                            help='Added to the timestamps, such as the Unix '
+                                 'timestamp of the start of the video')
+    arg_parser.add_argument('--debug', action='store_true')
+
+    args = arg_parser.parse_args()
+
+    logging.basicConfig(level=logging.DEBUG if args.debug else logging.INFO,
+                        format='%(asctime)s - %(levelname)s - %(message)s')
+
+    config = read_config(args.config_file)
+    source_input = get_source_input(config, args.config_file)
+
+    if not os.path.isfile(source_input):
+        raise ValueError('Offline mode requires a local video file')
+
+    duration = get_video_duration(source_input)
+    segments = list(get_segments(duration, args.segment_duration,
+                                 args.overlap))
+
+    _logger.info('OCR %.0f seconds of video in %d segments with %d jobs',
+                 duration, len(segments), args.jobs)
+
+    start_time = time.perf_counter()
+    last_docs = {}
+    text_count = 0
+
+    with multiprocessing.Pool(args.jobs) as pool, \
+            open(args.output_file, 'w') as file:
+        results = pool.imap(
+            functools.partial(ocr_segment, args.config_file), segments
+        )
+
+        for segment, docs in zip(segments, results):
+            for doc in stitch_segment(docs, last_docs, args.overlap):
+                doc = dict(doc, timestamp=doc['timestamp'] + args.time_offset)
+                file.write(encode_json(doc))
+                file.write('\n')
+                text_count += 1
+
+            file.flush()
+
+            _logger.info('Finished segment %d of %d (%.1fx real time)',
+                         segment.index + 1, len(segments),
+                         segment.end / (time.perf_counter() - start_time))
+
+    _logger.info('Wrote %d texts', text_count)
+
+
+if __name__ == '__main__':
+    main()
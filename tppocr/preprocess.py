@@ -0,0 +1,258 @@
+import abc
+import collections
+import logging
+import math
+from typing import Tuple, Any
+
+import PIL.Image
+import PIL.ImageOps
+
+from tppocr.math import RectangleTuple, Size2DTuple
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+_logger = logging.getLogger(__name__)
+
+DROP_SHADOW_THRESHOLD = 100
+
+ResizeCoefficientsTuple = collections.namedtuple(
+    'ResizeCoefficientsTuple',
+    ['horizontal', 'vertical']
+)
+
+
+class BasePreprocessor(metaclass=abc.ABCMeta):
+    def __init__(self, text_drop_shadow_filter: bool=False):
+        self._text_drop_shadow_filter = text_drop_shadow_filter
+
+    @abc.abstractmethod
+    def crop_frame(self, frame_data: memoryview, frame_size: Size2DTuple,
+                   region: RectangleTuple) -> Any:
+        pass
+
+    @abc.abstractmethod
+    def to_image(self, cropped_image: Any) -> PIL.Image.Image:
+        pass
+
+    def prepare(self, size: Size2DTuple, resized_size: Size2DTuple) -> Any:
+        # Returns data derived from the region size that is passed to
+        # preprocess() until the size changes
+        return None
+
+    @abc.abstractmethod
+    def preprocess(self, cropped_image: Any, resized_size: Size2DTuple,
+                   prepared_data: Any) -> PIL.Image.Image:
+        pass
+
+
+class PILPreprocessor(BasePreprocessor):
+    def crop_frame(self, frame_data: memoryview, frame_size: Size2DTuple,
+                   region: RectangleTuple) -> PIL.Image.Image:
+        image = PIL.Image.frombuffer('L', frame_size, frame_data,
+                                     'raw', 'L', 0, 1)
+
+        return image.crop(region)
+
+    def to_image(self, cropped_image: PIL.Image.Image) -> PIL.Image.Image:
+        return cropped_image
+
+    def preprocess(self, image: PIL.Image.Image, resized_size: Size2DTuple,
+                   prepared_data: Any) -> PIL.Image.Image:
+        image = PIL.ImageOps.autocontrast(image)
+
+        image = image.resize(resized_size, resample=PIL.Image.BILINEAR)
+
+        if self._text_drop_shadow_filter:
+            image = image.point(
+                lambda i: 255 if i > DROP_SHADOW_THRESHOLD else i
+            )
+
+        return image
+
+
+class NumPyPreprocessor(BasePreprocessor):
+    # Produces the same pixels as PILPreprocessor. Autocontrast and the
+    # drop shadow filter are table lookups and the bilinear resize
+    # uses the same fixed point coefficients as Pillow's resampling.
+    PRECISION_BITS = 32 - 8 - 2
+
+    def __init__(self, text_drop_shadow_filter: bool=False):
+        if not numpy:
+            raise ImportError('NumPy is required for the numpy '
+                              'preprocessing engine')
+
+        super().__init__(text_drop_shadow_filter)
+        self._autocontrast_luts = {}
+        self._drop_shadow_lut = numpy.array(
+            list(255 if i > DROP_SHADOW_THRESHOLD else i for i in range(256)),
+            dtype=numpy.uint8
+        )
+
+    def crop_frame(self, frame_data: memoryview, frame_size: Size2DTuple,
+                   region: RectangleTuple) -> 'numpy.ndarray':
+        x1, y1, x2, y2 = region
+        frame = numpy.frombuffer(frame_data, dtype=numpy.uint8)
+        frame = frame.reshape(frame_size.height, frame_size.width)
+
+        # Always a copy, as the frame buffer is reused once released
+        return frame[y1:y2, x1:x2].copy()
+
+    def to_image(self, cropped_image: 'numpy.ndarray') -> PIL.Image.Image:
+        return PIL.Image.fromarray(cropped_image, 'L')
+
+    def prepare(self, size: Size2DTuple, resized_size: Size2DTuple) -> \
+            ResizeCoefficientsTuple:
+        if resized_size.width != size.width:
+            horizontal = self._compute_resize_coefficients(
+                size.width, resized_size.width)
+        else:
+            horizontal = None
+
+        if resized_size.height != size.height:
+            vertical = self._compute_resize_coefficients(
+                size.height, resized_size.height)
+        else:
+            vertical = None
+
+        return ResizeCoefficientsTuple(horizontal, vertical)
+
+    def preprocess(self, array: 'numpy.ndarray', resized_size: Size2DTuple,
+                   prepared_data: ResizeCoefficientsTuple) -> PIL.Image.Image:
+        array = self._autocontrast(array)
+        array = self._resize(array, prepared_data)
+
+        if self._text_drop_shadow_filter:
+            array = self._drop_shadow_lut.take(array)
+        else:
+            array = array.astype(numpy.uint8, copy=False)
+
+        return PIL.Image.fromarray(array, 'L')
+
+    def _autocontrast(self, array: 'numpy.ndarray') -> 'numpy.ndarray':
+        histogram = numpy.bincount(array.ravel(), minlength=256)
+        nonzero = numpy.flatnonzero(histogram)
+        low = int(nonzero[0])
+        high = int(nonzero[-1])
+
+        if high <= low:
+            return array
+
+        return self._get_autocontrast_lut(low, high).take(array)
+
+    def _get_autocontrast_lut(self, low: int, high: int) -> 'numpy.ndarray':
+        lut = self._autocontrast_luts.get((low, high))
+
+        if lut is None:
+            # Same computation as PIL.ImageOps.autocontrast
+            scale = 255.0 / (high - low)
+            offset = -low * scale
+            lut = numpy.array(
+                list(min(255, max(0, int(i * scale + offset)))
+                     for i in range(256)),
+                dtype=numpy.uint8
+            )
+            self._autocontrast_luts[(low, high)] = lut
+
+        return lut
+
+    def _resize(self, array: 'numpy.ndarray',
+                coefficients: ResizeCoefficientsTuple) -> 'numpy.ndarray':
+        # Returns values from 0 to 255 but not necessarily as uint8
+
+        # Pillow resamples horizontally first with 8-bit rounding of the
+        # intermediate image
+        if coefficients.horizontal:
+            indexes, weights = coefficients.horizontal
+            array = self._convolve(array, indexes, weights, horizontal=True)
+
+        if coefficients.vertical:
+            if array.dtype != numpy.uint8:
+                array = array.astype(numpy.uint8)
+
+            indexes, weights = coefficients.vertical
+            array = self._convolve(array, indexes, weights, horizontal=False)
+
+        return array
+
+    def _convolve(self, array: 'numpy.ndarray', indexes: 'numpy.ndarray',
+                  weights: 'numpy.ndarray', horizontal: bool) -> \
+            'numpy.ndarray':
+        total = None
+
+        for tap in range(weights.shape[1]):
+            if horizontal:
+                values = array[:, indexes[:, tap]] * weights[:, tap]
+            else:
+                values = array[indexes[:, tap]] * weights[:, tap, None]
+
+            if total is None:
+                total = values
+                total += 1 << (self.PRECISION_BITS - 1)
+            else:
+                total += values
+
+        # The bilinear weights are positive and sum to 1 so the results
+        # don't need clipping to 0..255
+        total >>= self.PRECISION_BITS
+
+        return total
+
+    @classmethod
+    def _compute_resize_coefficients(cls, in_size: int, out_size: int) -> \
+            Tuple['numpy.ndarray', 'numpy.ndarray']:
+        # Port of precompute_coeffs() and normalize_coeffs_8bpc() from
+        # Pillow's Resample.c for the bilinear filter
+        support = 1.0
+        scale = filter_scale = in_size / out_size
+
+        if filter_scale < 1.0:
+            filter_scale = 1.0
+
+        support *= filter_scale
+        inverse_scale = 1.0 / filter_scale
+        kernel_size = int(math.ceil(support)) * 2 + 1
+        indexes = numpy.zeros((out_size, kernel_size), dtype=numpy.intp)
+        weights = numpy.zeros((out_size, kernel_size), dtype=numpy.int32)
+
+        for out_index in range(out_size):
+            center = (out_index + 0.5) * scale
+            x_min = max(0, int(center - support + 0.5))
+            x_max = min(in_size, int(center + support + 0.5)) - x_min
+
+            kernel = []
+            kernel_sum = 0.0
+
+            # Summed in order since sum() may compensate for rounding
+            for x in range(x_max):
+                value = max(
+                    0.0, 1.0 - abs((x + x_min - center + 0.5) * inverse_scale)
+                )
+                kernel.append(value)
+                kernel_sum += value
+
+            for x, value in enumerate(kernel):
+                if kernel_sum != 0.0:
+                    value /= kernel_sum
+
+                indexes[out_index, x] = x + x_min
+                weights[out_index, x] = int(
+                    0.5 + value * (1 << cls.PRECISION_BITS)
+                )
+
+        # Drop taps that are never used
+        used_taps = weights.any(axis=0)
+
+        return indexes[:, used_taps], weights[:, used_taps]
+
+
+def new_preprocessor(name: str, text_drop_shadow_filter: bool=False) -> \
+        BasePreprocessor:
+    if name == 'pil':
+        return PILPreprocessor(text_drop_shadow_filter)
+    elif name == 'numpy':
+        return NumPyPreprocessor(text_drop_shadow_filter)
+    else:
+        raise ValueError('Unknown preprocessing engine {}'.format(name))
@@ -0,0 +1,175 @@
+import argparse
+import contextlib
+import logging
+import sqlite3
+import time
+from typing import Iterable, List, Optional
+
+import redis
+
+from tppocr.wire import get_subscribe_channel, decode_message
+
+_logger = logging.getLogger(__name__)
+
+SEARCH_LIMIT = 100
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS texts (
+    id INTEGER PRIMARY KEY,
+    timestamp REAL NOT NULL,
+    section TEXT,
+    text TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS texts_timestamp ON texts (timestamp);
+CREATE INDEX IF NOT EXISTS texts_section_timestamp
+    ON texts (section, timestamp);
+CREATE VIRTUAL TABLE IF NOT EXISTS texts_fts USING fts5 (
+    text, content='texts', content_rowid='id'
+);
+'''
+
+
+class TextArchive:
+    # Output text in SQLite with a full text index. The writer and the
+    # readers use separate connections; WAL mode lets searches run while
+    # the subscriber is writing.
+    def __init__(self, path: str, read_only: bool=False):
+        self._path = path
+        self._read_only = read_only
+
+        if read_only:
+            self._conn = sqlite3.connect(
+                'file:{}?mode=ro'.format(path), uri=True,
+                check_same_thread=False
+            )
+        else:
+            self._conn = sqlite3.connect(path)
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute('PRAGMA synchronous=NORMAL')
+            self._conn.executescript(SCHEMA)
+
+    def close(self):
+        self._conn.close()
+
+    def add_texts(self, docs: Iterable[dict]):
+        with self._conn:
+            for doc in docs:
+                cursor = self._conn.execute(
+                    'INSERT INTO texts (timestamp, section, text) '
+                    'VALUES (?, ?, ?)',
+                    (doc['timestamp'], doc.get('section'), doc['text'])
+                )
+                self._conn.execute(
+                    'INSERT INTO texts_fts (rowid, text) VALUES (?, ?)',
+                    (cursor.lastrowid, doc['text'])
+                )
+
+    def search(self, query: Optional[str]=None,
+               sections: Optional[Iterable[str]]=None,
+               start: Optional[float]=None, end: Optional[float]=None,
+               before_id: Optional[int]=None,
+               limit: int=SEARCH_LIMIT) -> List[dict]:
+        # Newest first. For the next page, pass the smallest id of the
+        # previous page as before_id.
+        conditions = []
+        params = []
+
+        if query:
+            conditions.append(
+                'id IN (SELECT rowid FROM texts_fts WHERE texts_fts MATCH ?)'
+            )
+            params.append(query)
+
+        if sections is not None:
+            sections = list(sections)
+            conditions.append('section IN ({})'.format(
+                ', '.join('?' * len(sections))
+            ))
+            params.extend(sections)
+
+        if start is not None:
+            conditions.append('timestamp >= ?')
+            params.append(start)
+
+        if end is not None:
+            conditions.append('timestamp < ?')
+            params.append(end)
+
+        if before_id is not None:
+            conditions.append('id < ?')
+            params.append(before_id)
+
+        sql = 'SELECT id, timestamp, section, text FROM texts'
+
+        if conditions:
+            sql += ' WHERE ' + ' AND '.join(conditions)
+
+        sql += ' ORDER BY id DESC LIMIT ?'
+        params.append(limit)
+
+        return list(
+            {'id': row[0], 'timestamp': row[1], 'section': row[2],
+             'text': row[3]}
+            for row in self._conn.execute(sql, params)
+        )
+
+
+def main():
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument('database', help='Path of the SQLite database')
+
+    arg_parser.add_argument('--redis-host', default='localhost')
+    arg_parser.add_argument('--redis-port', default=6379, type=int)
+    arg_parser.add_argument('--redis-db', default=0, type=int)
+    arg_parser.add_argument('--wire-format', default='json',
+                            choices=['json', 'msgpack'],
+                            help='Format of the subscribed messages')
+    arg_parser.add_argument('--channel-prefix', default='',
+                            help='Prefix of the Redis channels and keys of '
+                                 'the stream')
+    arg_parser.add_argument('--commit-interval', type=float, default=1,
+                            help='Maximum seconds texts are buffered')
+
+    args = arg_parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO,
+                        format='%(asctime)s - %(levelname)s - %(message)s')
+
+    redis_conn = redis.StrictRedis(
+        args.redis_host, args.redis_port, args.redis_db,
+        decode_responses=args.wire_format == 'json', errors='replace'
+    )
+    channel = get_subscribe_channel(args.wire_format, args.channel_prefix)
+
+    archive = TextArchive(args.database)
+    pubsub = redis_conn.pubsub(ignore_subscribe_messages=True)
+    pubsub.subscribe(channel)
+
+    docs = []
+    commit_timestamp = time.monotonic()
+
+    with contextlib.closing(archive):
+        try:
+            while True:
+                message = pubsub.get_message(timeout=args.commit_interval)
+
+                if message and message.get('type') == 'message':
+                    doc = decode_message(message['data'], args.wire_format)
+
+                    if doc and doc['type'] == 'output_text':
+                        docs.append(doc)
+
+                if time.monotonic() - commit_timestamp >= \
+                        args.commit_interval:
+                    if docs:
+                        archive.add_texts(docs)
+                        docs = []
+
+                    commit_timestamp = time.monotonic()
+        finally:
+            if docs:
+                archive.add_texts(docs)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,40 +1,206 @@
 import argparse
 import datetime
-import json
+import gzip
+import logging
 import os
+import re
+import time
+from typing import Optional, Set
 
 import redis
-import time
 
-from tppocr.text import PUBLISH_CHANNEL
+from tppocr.wire import get_subscribe_channel, decode_message, encode_json
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+_logger = logging.getLogger(__name__)
+
+COMPRESSION_EXTENSIONS = {
+    None: '',
+    'gzip': '.gz',
+    'zstd': '.zst',
+}
 
 
 class TextLogger:
-    def __init__(self, log_directory: str):
+    # Writes lines to a file per UTC day. Lines are buffered and written
+    # when flush_size bytes are buffered or flush_interval seconds have
+    # passed. With compression, each flush is written as a separate gzip
+    # member or zstd frame so the file can be decompressed from any of the
+    # offsets in the index file. The index has the offset of the first
+    # line of each hour.
+    def __init__(self, log_directory: str, name: str='tppocr',
+                 compression: Optional[str]=None, flush_interval: float=1,
+                 flush_size: int=65536):
+        if compression not in COMPRESSION_EXTENSIONS:
+            raise ValueError('Unknown compression {}'.format(compression))
+
+        if compression == 'zstd' and not zstandard:
+            raise ImportError('zstandard is required for zstd compression')
+
         self._log_directory = log_directory
+        self._name = name
+        self._compression = compression
+        self._flush_interval = flush_interval
+        self._flush_size = flush_size
         self._log_path = None
         self._log_file = None
+        self._index_file = None
+        self._indexed_hours = set()
+        self._buffer = []
+        self._buffer_size = 0
+        self._flush_timestamp = time.monotonic()
+        self._day_start_timestamp = 0
+        self._day_end_timestamp = 0
+        self._hour_end_timestamp = 0
+        self._zstd_compressor = zstandard.ZstdCompressor() \
+            if compression == 'zstd' else None
+
+    def log_text(self, text: str, timestamp: Optional[float]=None):
+        if timestamp is None:
+            timestamp = time.time()
+
+        if not self._day_start_timestamp <= timestamp < self._day_end_timestamp:
+            self.flush()
+            self._open_log(timestamp)
+
+        if timestamp >= self._hour_end_timestamp:
+            # Start the hour on a flush boundary so its offset is seekable
+            self.flush()
+            self._start_hour(timestamp)
+
+        data = text.encode('utf-8') + b'\n'
+        self._buffer.append(data)
+        self._buffer_size += len(data)
+
+        if self._buffer_size >= self._flush_size:
+            self.flush()
 
-    def _open_log(self):
-        datetime_now = datetime.datetime.now(datetime.timezone.utc)
-        date_now = datetime_now.date()
+    def flush_if_due(self):
+        if time.monotonic() - self._flush_timestamp >= self._flush_interval:
+            self.flush()
 
-        path = os.path.join(self._log_directory,
-                            'tppocr.{}.log'.format(date_now.isoformat())
-                            )
+    def flush(self):
+        self._flush_timestamp = time.monotonic()
+
+        if not self._buffer:
+            return
+
+        data = b''.join(self._buffer)
+        self._buffer = []
+        self._buffer_size = 0
+
+        if self._compression == 'gzip':
+            data = gzip.compress(data)
+        elif self._compression == 'zstd':
+            data = self._zstd_compressor.compress(data)
+
+        self._log_file.write(data)
+        self._log_file.flush()
+        self._index_file.flush()
+
+    def close(self):
+        self.flush()
+
+        if self._log_file:
+            self._log_file.close()
+            self._index_file.close()
+            self._log_file = None
+            self._index_file = None
+
+    def _open_log(self, timestamp: float):
+        datetime_now = datetime.datetime.fromtimestamp(
+            timestamp, datetime.timezone.utc)
+        day_start = datetime_now.replace(hour=0, minute=0, second=0,
+                                         microsecond=0)
+        self._day_start_timestamp = day_start.timestamp()
+        self._day_end_timestamp = \
+            (day_start + datetime.timedelta(days=1)).timestamp()
+        self._hour_end_timestamp = 0
+
+        path = os.path.join(
+            self._log_directory,
+            '{}.{}.log{}'.format(self._name, day_start.date().isoformat(),
+                                 COMPRESSION_EXTENSIONS[self._compression])
+        )
 
         if path != self._log_path:
             if self._log_file:
                 self._log_file.close()
+                self._index_file.close()
 
+            _logger.info('Opening %s', path)
             self._log_path = path
-            self._log_file = open(path, 'w')
+            self._indexed_hours = read_indexed_hours(path + '.idx')
+            self._log_file = open(path, 'ab')
+            self._index_file = open(path + '.idx', 'a')
 
-    def log_text(self, text: str):
-        self._open_log()
-        self._log_file.write(text)
-        self._log_file.write('\n')
-        self._log_file.flush()
+    def _start_hour(self, timestamp: float):
+        hour_start = datetime.datetime.fromtimestamp(
+            timestamp, datetime.timezone.utc
+        ).replace(minute=0, second=0, microsecond=0)
+        self._hour_end_timestamp = \
+            (hour_start + datetime.timedelta(hours=1)).timestamp()
+        hour = hour_start.strftime('%Y-%m-%dT%H')
+
+        # After a restart, the hour's first offset is already in the index
+        if hour in self._indexed_hours:
+            return
+
+        self._indexed_hours.add(hour)
+        self._index_file.write('{} {}\n'.format(hour, self._log_file.tell()))
+
+
+def read_indexed_hours(index_path: str) -> Set[str]:
+    if not os.path.exists(index_path):
+        return set()
+
+    with open(index_path) as file:
+        return set(line.split()[0] for line in file if line.strip())
+
+
+class TextArchiver:
+    # Routes messages to a TextLogger per stream. Output text goes to the
+    # "tppocr" stream and, when enabled, raw text to "tppocr.raw_text".
+    # With per_section, each section has its own streams.
+    def __init__(self, log_directory: str, raw_text: bool=False,
+                 per_section: bool=False, **logger_kwargs):
+        self._log_directory = log_directory
+        self._raw_text = raw_text
+        self._per_section = per_section
+        self._logger_kwargs = logger_kwargs
+        self._loggers = {}
+
+    def archive(self, doc: dict, json_str: str):
+        if doc['type'] == 'output_text':
+            name = 'tppocr'
+        elif doc['type'] == 'raw_text' and self._raw_text:
+            name = 'tppocr.raw_text'
+        else:
+            return
+
+        if self._per_section and doc.get('section'):
+            name += '.' + re.sub(r'[^\w-]', '_', doc['section'])
+
+        text_logger = self._loggers.get(name)
+
+        if not text_logger:
+            text_logger = self._loggers[name] = TextLogger(
+                self._log_directory, name, **self._logger_kwargs
+            )
+
+        text_logger.log_text(json_str)
+
+    def flush_if_due(self):
+        for text_logger in self._loggers.values():
+            text_logger.flush_if_due()
+
+    def close(self):
+        for text_logger in self._loggers.values():
+            text_logger.close()
 
 
 def main():
@@ -44,29 +210,59 @@ def main():
     arg_parser.add_argument('--redis-host', default='localhost')
     arg_parser.add_argument('--redis-port', default=6379, type=int)
     arg_parser.add_argument('--redis-db', default=0, type=int)
+    arg_parser.add_argument('--wire-format', default='json',
+                            choices=['json', 'msgpack'],
+                            help='Format of the subscribed messages')
+    arg_parser.add_argument('--channel-prefix', default='',
+                            help='Prefix of the Redis channels and keys of '
+                                 'the stream')
+    arg_parser.add_argument('--compression', choices=['gzip', 'zstd'])
+    arg_parser.add_argument('--flush-interval', type=float, default=1,
+                            help='Maximum seconds lines are buffered')
+    arg_parser.add_argument('--flush-size', type=int, default=65536,
+                            help='Maximum bytes buffered per file')
+    arg_parser.add_argument('--raw-text', action='store_true',
+                            help='Also archive raw text to separate files')
+    arg_parser.add_argument('--per-section', action='store_true',
+                            help='Use separate files for each section')
 
     args = arg_parser.parse_args()
 
+    logging.basicConfig(level=logging.INFO,
+                        format='%(asctime)s - %(levelname)s - %(message)s')
+
     redis_conn = redis.StrictRedis(
         args.redis_host, args.redis_port, args.redis_db,
-        decode_responses=True, errors='replace'
+        decode_responses=args.wire_format == 'json', errors='replace'
     )
+    channel = get_subscribe_channel(args.wire_format, args.channel_prefix)
 
-    text_logger = TextLogger(args.output_directory)
-    pubsub = redis_conn.pubsub()
-    pubsub.subscribe(PUBLISH_CHANNEL)
-
-    while True:
-        message = pubsub.get_message()
-        if message:
-            if message.get('channel') == PUBLISH_CHANNEL and \
-                    message.get('type') == 'message':
-                text = message['data']
-                doc = json.loads(text)
-                if doc['type'] == 'output_text':
-                    text_logger.log_text(text)
-        else:
-            time.sleep(0.1)
+    archiver = TextArchiver(
+        args.output_directory, raw_text=args.raw_text,
+        per_section=args.per_section, compression=args.compression,
+        flush_interval=args.flush_interval, flush_size=args.flush_size
+    )
+    pubsub = redis_conn.pubsub(ignore_subscribe_messages=True)
+    pubsub.subscribe(channel)
+
+    try:
+        while True:
+            # Blocks until a message arrives or it is time to flush
+            message = pubsub.get_message(timeout=args.flush_interval)
+
+            if message and message.get('type') == 'message' and \
+                    message.get('channel') in (channel, channel.encode()):
+                doc = decode_message(message['data'], args.wire_format)
+
+                if doc:
+                    if args.wire_format == 'json':
+                        archiver.archive(doc, message['data'])
+                    else:
+                        archiver.archive(doc, encode_json(doc))
+
+            archiver.flush_if_due()
+    finally:
+        archiver.close()
 
 
 if __name__ == '__main__':
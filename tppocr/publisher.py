@@ -0,0 +1,143 @@
+import collections
+import logging
+import threading
+import time
+
+import redis
+
+from tppocr.metrics import Metrics
+
+_logger = logging.getLogger(__name__)
+
+PublishCommand = collections.namedtuple(
+    'PublishCommand', ['name', 'args', 'droppable']
+)
+
+
+class RedisPublisher(threading.Thread):
+    # Queues Redis commands in an outbox so the OCR threads don't wait on
+    # Redis. A writer thread sends them in pipelined batches and retries
+    # after connection errors. When the outbox is full, the oldest
+    # droppable commands (raw text and debug images) are discarded.
+    # Commands that are not droppable are always kept.
+    MAX_RETRY_DELAY = 30
+
+    def __init__(self, redis_conn: redis.StrictRedis, max_size: int=1000,
+                 batch_size: int=100, metrics: Metrics=None):
+        super().__init__(daemon=True)
+        self._redis_conn = redis_conn
+        self._max_size = max_size
+        self._batch_size = batch_size
+        self._metrics = metrics or Metrics()
+        self._outbox = collections.deque()
+        self._condition = threading.Condition()
+        self._running = True
+        self._log_cooldown_timestamp = 0
+
+        self._metrics.add_gauge('redis_outbox_depth', lambda: len(self._outbox))
+
+    def publish(self, channel: str, message: str, droppable: bool=False):
+        self._put(PublishCommand('publish', (channel, message), droppable))
+
+    def append_list(self, key: str, value: str, limit: int):
+        # Appends to a list trimmed to the last limit items
+        self._put(PublishCommand('rpush', (key, value), False))
+        self._put(PublishCommand('ltrim', (key, -limit, -1), False))
+
+    def stop(self):
+        with self._condition:
+            self._running = False
+            self._condition.notify()
+
+    def run(self):
+        retry_delay = 1
+
+        while True:
+            with self._condition:
+                while self._running and not self._outbox:
+                    self._condition.wait()
+
+                if not self._outbox:
+                    break
+
+                batch = list(
+                    self._outbox.popleft()
+                    for dummy in range(min(self._batch_size, len(self._outbox)))
+                )
+
+            try:
+                self._write_batch(batch)
+            except redis.RedisError as error:
+                # Once connected, the commands may have run, so only
+                # connection and timeout errors are retried
+                if not isinstance(error, (redis.ConnectionError,
+                                          redis.TimeoutError)):
+                    _logger.exception('Redis publish failed. Dropped %d '
+                                      'commands.', len(batch))
+                    self._metrics.increment('redis_dropped_commands',
+                                            len(batch))
+                    continue
+
+                _logger.exception('Redis publish failed. Retrying in %s '
+                                  'seconds.', retry_delay)
+
+                with self._condition:
+                    self._outbox.extendleft(reversed(batch))
+                    self._drop_excess()
+
+                    if not self._running:
+                        break
+
+                time.sleep(retry_delay)
+                retry_delay = min(self.MAX_RETRY_DELAY, retry_delay * 2)
+            else:
+                retry_delay = 1
+
+    def _write_batch(self, batch):
+        with self._metrics.measure('redis_publish'):
+            pipeline = self._redis_conn.pipeline(transaction=False)
+
+            for command in batch:
+                getattr(pipeline, command.name)(*command.args)
+
+            # The other commands of the pipeline have run even when one
+            # fails, so the failed command is dropped instead of retrying
+            # the batch
+            results = pipeline.execute(raise_on_error=False)
+
+        for command, result in zip(batch, results):
+            if isinstance(result, redis.ResponseError):
+                _logger.error('Redis %s command failed: %s', command.name,
+                              result)
+                self._metrics.increment('redis_dropped_commands')
+
+    def _put(self, command: PublishCommand):
+        with self._condition:
+            self._outbox.append(command)
+            self._drop_excess()
+            self._condition.notify()
+
+    def _drop_excess(self):
+        excess_count = len(self._outbox) - self._max_size
+
+        if excess_count <= 0:
+            return
+
+        kept_commands = collections.deque()
+        dropped_count = 0
+
+        for command in self._outbox:
+            if dropped_count < excess_count and command.droppable:
+                dropped_count += 1
+            else:
+                kept_commands.append(command)
+
+        self._outbox = kept_commands
+
+        if dropped_count:
+            self._metrics.increment('redis_dropped_messages', dropped_count)
+
+            time_now = time.time()
+            if time_now - self._log_cooldown_timestamp > 60:
+                _logger.warning('Redis outbox full. Dropping messages.')
+                self._log_cooldown_timestamp = time_now
@@ -1,13 +1,25 @@
 import queue
 import threading
 
-from typing import Tuple
+from typing import Tuple, Sequence
+
+from tppocr.framerate import AdaptiveFrameRate
+from tppocr.metrics import Metrics
 
 
 class ConsumerBroadcastQueue(threading.Thread):
-    def __init__(self, producer_queue: queue.Queue, num_consumer_queues: int=0, consumer_queue_maxsize: int=5):
+    def __init__(self, producer_queue: queue.Queue, num_consumer_queues: int=0, consumer_queue_maxsize: int=5,
+                 metrics: Metrics=None, consumer_names: Sequence[str]=None,
+                 frame_rate: AdaptiveFrameRate=None, lossless: bool=False):
         threading.Thread.__init__(self, daemon=True)
         self._producer_queue = producer_queue
+        # Whether to wait for slow consumers instead of dropping frames
+        self._lossless = lossless
+        self._metrics = metrics or Metrics()
+        self._frame_rate = frame_rate
+        self._consumer_names = tuple(
+            consumer_names or range(num_consumer_queues)
+        )
         self._consumer_queues = tuple(
             queue.Queue(consumer_queue_maxsize)
             for dummy in range(num_consumer_queues)
@@ -25,11 +37,32 @@ class ConsumerBroadcastQueue(threading.Thread):
         while True:
             item = self._producer_queue.get()
 
-            for consumer_queue in self._consumer_queues:
+            if item is not None and self._frame_rate:
+                self._frame_rate.update(dict(
+                    (consumer_name, consumer_queue.qsize())
+                    for consumer_name, consumer_queue in
+                    zip(self._consumer_names, self._consumer_queues)
+                ))
+
+                if not self._frame_rate.keep_frame():
+                    item.release()
+                    continue
+
+            if item is not None:
+                item.retain(len(self._consumer_queues))
+
+            for consumer_name, consumer_queue in \
+                    zip(self._consumer_names, self._consumer_queues):
                 try:
-                    consumer_queue.put(item, timeout=1)
+                    consumer_queue.put(
+                        item, timeout=None if self._lossless else 1)
                 except queue.Full:
-                    pass
+                    if item is not None:
+                        item.release()
+                        self._metrics.increment(
+                            'consumer_dropped_frames.{}'.format(consumer_name))
 
             if item is None:
                 break
+
+            item.release()
@@ -0,0 +1,81 @@
+import math
+from typing import Optional, Sequence
+
+
+def indel_distance(a: Sequence, b: Sequence, max_distance: int) -> \
+        Optional[int]:
+    # Number of insertions and deletions needed to turn a into b using
+    # Myers' O(ND) algorithm. Returns None once the distance is known to be
+    # greater than max_distance so the work is bounded by it.
+    if max_distance < 0 or abs(len(a) - len(b)) > max_distance:
+        return None
+
+    # Strip the common prefix and suffix which are free to match
+    start = 0
+    end_a = len(a)
+    end_b = len(b)
+
+    while start < end_a and start < end_b and a[start] == b[start]:
+        start += 1
+
+    while end_a > start and end_b > start and a[end_a - 1] == b[end_b - 1]:
+        end_a -= 1
+        end_b -= 1
+
+    a = a[start:end_a]
+    b = b[start:end_b]
+    len_a = len(a)
+    len_b = len(b)
+
+    if not len_a or not len_b:
+        return len_a + len_b
+
+    # Furthest reaching x on each diagonal k = x - y
+    offset = max_distance + 1
+    furthest_x = [0] * (2 * max_distance + 3)
+
+    for distance in range(max_distance + 1):
+        for k in range(-distance, distance + 1, 2):
+            if k == -distance or (k != distance and
+                                  furthest_x[offset + k - 1] <
+                                  furthest_x[offset + k + 1]):
+                x = furthest_x[offset + k + 1]
+            else:
+                x = furthest_x[offset + k - 1] + 1
+
+            y = x - k
+
+            while x < len_a and y < len_b and a[x] == b[y]:
+                x += 1
+                y += 1
+
+            furthest_x[offset + k] = x
+
+            if x >= len_a and y >= len_b:
+                return distance
+
+    return None
+
+
+def is_similar(a: Sequence, b: Sequence, threshold: float) -> bool:
+    # Whether the ratio 2 * LCS / (len(a) + len(b)) is greater than the
+    # threshold. This is the ratio difflib.SequenceMatcher approximates.
+    # difflib's ratio is never higher, so where the decisions differ, only
+    # this one finds the texts similar. That is under 1% of edited dialog
+    # lines, but about 5% of pairs drawn from a few letters and about half
+    # of such pairs over 200 characters, where difflib ignores the common
+    # letters as junk.
+    total = len(a) + len(b)
+
+    if not total:
+        return True
+
+    if a == b[:len(a)] or b == a[:len(b)]:
+        # Prefix extension, the common case for dialog text being typed out
+        return 2 * min(len(a), len(b)) / total > threshold
+
+    # ratio > threshold if and only if distance < (1 - threshold) * total
+    max_distance = int(math.ceil((1 - threshold) * total)) - 1
+    distance = indel_distance(a, b, max_distance)
+
+    return distance is not None and (total - distance) / total > threshold
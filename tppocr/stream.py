@@ -6,27 +6,65 @@ import queue
 import subprocess
 import threading
 import time
-from typing import Tuple
+from typing import BinaryIO, Callable, List, Optional
 
-from tppocr.math import Size2DTuple
+from tppocr.frame import Frame, FrameGeometry, FrameRing
+from tppocr.math import Size2DTuple, RectangleTuple
+from tppocr.metrics import Metrics
 
 _logger = logging.getLogger()
 
 
 class BaseStream(metaclass=abc.ABCMeta):
     def __init__(self, output_fps: int=4, native_frame_rate: bool=False,
-                 frame_queue: queue.Queue=None):
+                 frame_queue: queue.Queue=None,
+                 crop_region: RectangleTuple=None, crop_scale: float=1.0,
+                 frame_buffer_count: int=16, metrics: Metrics=None,
+                 lossless: bool=False, reconnect_min_delay: float=0.5,
+                 reconnect_max_delay: float=30, standby_decoder: bool=False):
         super().__init__()
         self._output_fps = output_fps
         self._native_frame_rate = native_frame_rate
-        self._frame_size = Size2DTuple(0, 0)
+        self._crop_region = crop_region
+        self._crop_scale = crop_scale
+        self._geometry = FrameGeometry(
+            Size2DTuple(0, 0), Size2DTuple(0, 0), RectangleTuple(0, 0, 0, 0)
+        )
         self._frame_queue = frame_queue or queue.Queue(5)
+        self._frame_buffer_count = frame_buffer_count
+        self._metrics = metrics or Metrics()
+        # Whether to wait for space in the frame queue instead of dropping
+        self._lossless = lossless
+        self._reconnect_min_delay = reconnect_min_delay
+        self._reconnect_max_delay = reconnect_max_delay
+        # Whether to keep a second ffmpeg connected to take over when the
+        # active one exits
+        self._standby_decoder = standby_decoder
         self._running = False
-        self._current_proc = None
+        self._stop_event = threading.Event()
+        self._decoder = None
+        self._standby = None
+        self._log_cooldown_timestamp = 0
+
+    @property
+    def geometry(self) -> FrameGeometry:
+        '''Geometry of the latest frame put on the frame queue.'''
+        return self._geometry
 
     @property
     def frame_size(self) -> Size2DTuple:
-        return self._frame_size
+        '''Size of the frames put on the frame queue.'''
+        return self._geometry.frame_size
+
+    @property
+    def source_size(self) -> Size2DTuple:
+        '''Size of the video before cropping and scaling.'''
+        return self._geometry.source_size
+
+    @property
+    def crop_rectangle(self) -> RectangleTuple:
+        '''Pixel rectangle of the source video contained in the frames.'''
+        return self._geometry.crop_rectangle
 
     @property
     def frame_queue(self) -> queue.Queue:
@@ -40,33 +78,145 @@ class BaseStream(metaclass=abc.ABCMeta):
         _logger.info('Stream starting...')
         self._running = True
 
-        self._get_video_size()
+        reconnect_delay = self._reconnect_min_delay
 
         while self._running:
-            ffmpeg_thread = threading.Thread(target=self._run_ffmpeg, daemon=True)
-            ffmpeg_thread.start()
-            ffmpeg_thread.join()
+            if self._standby and self._standby.is_alive():
+                _logger.info('Switching to standby decoder')
+                decoder = self._standby
+            else:
+                decoder = self._try_start_decoder()
+
+            self._standby = None
+
+            if decoder:
+                self._decoder = decoder
+                decoder.activate()
+
+                if not self._running:
+                    # Stopped while ffmpeg was starting
+                    decoder.terminate()
+
+                if self._standby_decoder and self._running:
+                    self._standby = self._try_start_decoder()
+
+                decoder.join()
+                self._decoder = None
+                self._decoder_exited()
 
-            if self._running:
-                _logger.info('Sleeping...')
-                time.sleep(30)
+                if self._is_finished():
+                    _logger.info('Stopping due to local file')
+                    self.stop()
+                    break
+
+                if decoder.frame_count:
+                    reconnect_delay = self._reconnect_min_delay
+
+            if not self._running or \
+                    (self._standby and self._standby.is_alive()):
+                continue
+
+            _logger.info('Reconnecting in %.1f seconds...', reconnect_delay)
+            self._metrics.increment('stream_reconnects')
+
+            if self._stop_event.wait(reconnect_delay):
+                break
+
+            reconnect_delay = min(self._reconnect_max_delay,
+                                  reconnect_delay * 2)
+
+        # In case stop ran before the standby decoder was assigned
+        if self._standby:
+            self._standby.terminate()
+            self._standby = None
 
     def stop(self):
         self._running = False
-        self._terminate_ffmpeg()
+        self._stop_event.set()
+
+        for decoder in (self._decoder, self._standby):
+            if decoder:
+                decoder.terminate()
+
         self._frame_queue.put(None)
 
-    def _get_video_size(self):
-        _logger.info('Getting video size...')
-        self._frame_size = get_video_size(self._get_ffmpeg_url())
+    def _set_source_size(self, source_size: Size2DTuple):
+        self._geometry = self._get_source_geometry(source_size)
+
+    def _get_source_geometry(self, source_size: Size2DTuple) \
+            -> FrameGeometry:
+        if not self._crop_region:
+            return FrameGeometry(
+                source_size, source_size,
+                RectangleTuple(0, 0, source_size.width, source_size.height)
+            )
+
+        region = self._crop_region
+        crop_rectangle = RectangleTuple(
+            int(source_size.width * region.x1),
+            int(source_size.height * region.y1),
+            int(source_size.width * region.x2),
+            int(source_size.height * region.y2),
+        )
+        frame_size = Size2DTuple(
+            int((crop_rectangle.x2 - crop_rectangle.x1) * self._crop_scale),
+            int((crop_rectangle.y2 - crop_rectangle.y1) * self._crop_scale),
+        )
 
-    def _run_ffmpeg(self):
-        _logger.info('Running ffmpeg...')
+        return FrameGeometry(frame_size, source_size, crop_rectangle)
+
+    def _get_frame_geometry(self, frame_size: Size2DTuple) -> FrameGeometry:
+        # The decoded frames are already cropped and scaled so the source
+        # size is estimated from the frame size. The crop rectangle is
+        # consistent with the frame size so regions still map exactly onto
+        # the frame.
+        if not self._crop_region:
+            return self._get_source_geometry(frame_size)
+
+        region = self._crop_region
+        source_size = Size2DTuple(
+            round(frame_size.width / self._crop_scale /
+                  (region.x2 - region.x1)),
+            round(frame_size.height / self._crop_scale /
+                  (region.y2 - region.y1)),
+        )
+        geometry = self._get_source_geometry(source_size)
+
+        _logger.info('Video is about %s, cropped to %s and scaled to %s',
+                     source_size, geometry.crop_rectangle, frame_size)
+
+        return geometry._replace(frame_size=frame_size)
+
+    def _get_video_filters(self) -> List[str]:
+        if not self._crop_region:
+            return []
+
+        # The expressions are relative to the input size so they still
+        # apply if the resolution changes
+        x1, y1, x2, y2 = self._crop_region
+        filters = [
+            'crop=w=trunc(iw*{x2})-trunc(iw*{x1}):'
+            'h=trunc(ih*{y2})-trunc(ih*{y1}):'
+            'x=trunc(iw*{x1}):y=trunc(ih*{y1}):exact=1'
+            .format(x1=x1, y1=y1, x2=x2, y2=y2)
+        ]
 
+        if self._crop_scale != 1.0:
+            filters.append('scale=w=trunc(iw*{scale}):h=trunc(ih*{scale})'
+                           .format(scale=self._crop_scale))
+
+        return filters
+
+    def _get_frame_timestamp(self, frame_number: int) -> Optional[float]:
+        # Position of the frame in the video for streams that have one.
+        # Otherwise, the frame is timestamped when it is processed.
+        return None
+
+    def _get_ffmpeg_args(self) -> List[str]:
         args = [
             'ffmpeg',
             '-i', self._get_ffmpeg_url(),
-            '-f', 'image2pipe', '-pix_fmt', 'gray', '-vcodec', 'rawvideo',
+            '-f', 'yuv4mpegpipe', '-pix_fmt', 'gray',
             '-r', str(self._output_fps),
             '-nostats', '-v', 'error', '-nostdin', '-'
         ]
@@ -74,50 +224,148 @@ class BaseStream(metaclass=abc.ABCMeta):
         if self._native_frame_rate:
             args.insert(1, '-re')
 
+        video_filters = self._get_video_filters()
+
+        if video_filters:
+            index = args.index('-r')
+            args[index:index] = ['-vf', ','.join(video_filters)]
+
+        return args
+
+    def _start_decoder(self) -> 'FFmpegDecoder':
+        _logger.info('Running ffmpeg...')
+
+        decoder = FFmpegDecoder(self._get_ffmpeg_args(),
+                                self._get_frame_geometry,
+                                self._frame_buffer_count, self._put_frame,
+                                self._metrics)
+        decoder.start()
+
+        return decoder
+
+    def _try_start_decoder(self) -> Optional['FFmpegDecoder']:
+        try:
+            return self._start_decoder()
+        except (OSError, subprocess.SubprocessError):
+            _logger.exception('Start ffmpeg')
+            return None
+
+    def _put_frame(self, frame: Frame, frame_number: int):
+        frame.timestamp = self._get_frame_timestamp(frame_number)
+
+        if frame.geometry != self._geometry:
+            _logger.info('Frame size is %s', frame.geometry.frame_size)
+            self._geometry = frame.geometry
+
+        try:
+            self._frame_queue.put(
+                frame, timeout=None if self._lossless else 0.1)
+        except queue.Full:
+            frame.release()
+            self._metrics.increment('stream_dropped_frames')
+
+            time_now = time.time()
+            if time_now - self._log_cooldown_timestamp > 60:
+                _logger.warning('Queue full. You may need to lower '
+                                'settings or increase CPU power.')
+                self._log_cooldown_timestamp = time_now
+
+    def _decoder_exited(self):
+        pass
+
+    def _is_finished(self) -> bool:
+        return False
+
+
+class FFmpegDecoder(threading.Thread):
+    # Runs ffmpeg and reads its frames. The frame size is read from the
+    # YUV4MPEG2 stream header. Until activated, the frames are discarded
+    # so a standby decoder stays connected and caught up with the stream,
+    # ready to take over when the active decoder exits.
+    def __init__(self, args: List[str],
+                 get_geometry: Callable[[Size2DTuple], FrameGeometry],
+                 frame_buffer_count: int,
+                 put_frame: Callable[[Frame, int], None],
+                 metrics: Metrics=None):
+        super().__init__(daemon=True)
+        self._get_geometry = get_geometry
+        self._frame_buffer_count = frame_buffer_count
+        self._put_frame = put_frame
+        self._metrics = metrics or Metrics()
+        self._active = threading.Event()
+        self._frame_count = 0
+
         env = os.environ.copy()
         env['AV_LOG_FORCE_NOCOLOR'] = '1'
-        self._current_proc = proc = subprocess.Popen(
+        self._proc = subprocess.Popen(
             args,
             stdout=subprocess.PIPE,
             env=env
         )
-        frame_width, frame_height = self._frame_size
-        frame_data_size = frame_width * frame_height
 
-        frame_data = b''
+    @property
+    def frame_count(self) -> int:
+        '''Number of frames delivered while active.'''
+        return self._frame_count
 
-        _logger.info('Reading frames...')
+    def activate(self):
+        self._active.set()
 
-        log_cooldown_timestamp = 0
+    def run(self):
+        proc = self._proc
 
-        while proc.returncode is None:
-            frame_data += proc.stdout.read(frame_data_size - len(frame_data))
+        try:
+            self._read_frames(proc.stdout)
+        except ValueError:
+            _logger.exception('Invalid video from ffmpeg')
 
-            if not frame_data:
-                _logger.info('No data from ffmpeg')
-                break
+        self.terminate()
 
-            if len(frame_data) == frame_data_size:
-                _logger.debug('Read 1 frame')
-                try:
-                    self._frame_queue.put(frame_data, timeout=0.1)
-                except queue.Full:
-                    time_now = time.time()
-                    if time_now - log_cooldown_timestamp > 60:
-                        _logger.warning('Queue full. You may need to lower '
-                                        'settings or increase CPU power.')
-                        log_cooldown_timestamp = time_now
+        _logger.info('FFmpeg exited with %s', proc.returncode)
+
+    def _read_frames(self, file: BinaryIO):
+        header = file.readline()
 
-                frame_data = b''
+        if not header:
+            _logger.info('No data from ffmpeg')
+            return
 
-        self._terminate_ffmpeg()
+        frame_size = parse_y4m_header(header)
+        geometry = self._get_geometry(frame_size)
+        frame_ring = FrameRing(self._frame_buffer_count,
+                               frame_size.width * frame_size.height)
+        frame = frame_ring.acquire()
 
-        _logger.info('FFmpeg exited with %s', proc.returncode)
+        _logger.info('Reading frames...')
 
-    def _terminate_ffmpeg(self):
-        proc = self._current_proc
+        try:
+            while True:
+                frame_start_time = time.perf_counter()
+
+                if not read_y4m_frame(file, frame.data):
+                    _logger.info('No data from ffmpeg')
+                    break
+
+                if not self._active.is_set():
+                    # Standby. Reuse the frame for the next read.
+                    continue
+
+                _logger.debug('Read 1 frame')
+                self._metrics.observe('frame_read',
+                                      time.perf_counter() - frame_start_time)
+                self._metrics.increment('frames_read')
+                frame.geometry = geometry
+                self._put_frame(frame, self._frame_count)
+                self._frame_count += 1
+
+                frame = frame_ring.acquire()
+        finally:
+            frame.release()
 
-        if not proc:
+    def terminate(self):
+        proc = self._proc
+
+        if proc.returncode is not None:
             return
 
         _logger.info('Terminating ffmpeg...')
@@ -132,30 +380,54 @@ class BaseStream(metaclass=abc.ABCMeta):
         except (OSError, subprocess.SubprocessError):
             pass
 
-        self._current_proc = None
-
 
 class LiveStream(BaseStream):
-    def __init__(self, url: str, quality: str='medium', **kwargs):
+    # The stream URL is refreshed in the background so reconnecting
+    # doesn't wait for livestreamer. When ffmpeg exits, the URL may have
+    # expired, so a fresh one is fetched while waiting to reconnect.
+    def __init__(self, url: str, quality: str='medium',
+                 url_refresh_interval: float=60, **kwargs):
         super().__init__(**kwargs)
         self._url = url
         self._quality = quality
+        self._url_refresh_interval = url_refresh_interval
         self._video_url = None
-        self._video_url_timestamp = 0
+        self._refresh_event = threading.Event()
+
+    def run(self):
+        threading.Thread(target=self._run_url_refresh, daemon=True).start()
+        super().run()
+
+    def stop(self):
+        super().stop()
+        self._refresh_event.set()
+
+    def _run_url_refresh(self):
+        while True:
+            self._refresh_event.wait(self._url_refresh_interval)
+            self._refresh_event.clear()
+
+            if self._stop_event.is_set():
+                break
+
+            try:
+                self._refresh_video_url()
+            except (OSError, subprocess.SubprocessError):
+                _logger.exception('Refresh stream URL')
 
     def _refresh_video_url(self):
+        _logger.info('Getting fresh stream URL')
         self._video_url = get_video_url(self._url, self._quality)
-        self._video_url_timestamp = time.monotonic()
 
     def _get_ffmpeg_url(self) -> str:
-        timestamp_now = time.monotonic()
-
-        if timestamp_now - self._video_url_timestamp > 60:
-            _logger.info('Getting fresh stream URL')
+        if not self._video_url:
             self._refresh_video_url()
 
         return self._video_url
 
+    def _decoder_exited(self):
+        self._refresh_event.set()
+
 
 class URLStream(BaseStream):
     def __init__(self, url: str, **kwargs):
@@ -165,12 +437,8 @@ class URLStream(BaseStream):
     def _get_ffmpeg_url(self):
         return self._url
 
-    def _run_ffmpeg(self):
-        super()._run_ffmpeg()
-
-        if os.path.exists(self._url):
-            _logger.info('Stopping due to local file')
-            self.stop()
+    def _is_finished(self) -> bool:
+        return os.path.exists(self._url)
 
 
 def get_video_url(channel_url='twitch.tv/twitchplayspokemon', quality='medium') \
@@ -184,14 +452,57 @@ def get_video_url(channel_url='twitch.tv/twitchplayspokemon', quality='medium')
     return url
 
 
-def get_video_size(input_url: str) -> Size2DTuple:
+def parse_y4m_header(header: bytes) -> Size2DTuple:
+    params = header.split()
+
+    if not params or params[0] != b'YUV4MPEG2':
+        raise ValueError('Not a YUV4MPEG2 stream')
+
+    width = height = None
+
+    for param in params[1:]:
+        if param.startswith(b'W'):
+            width = int(param[1:])
+        elif param.startswith(b'H'):
+            height = int(param[1:])
+        elif param.startswith(b'C') and not param.startswith(b'Cmono'):
+            raise ValueError('Unsupported color space {}'.format(param))
+
+    if not width or not height:
+        raise ValueError('Missing frame size')
+
+    return Size2DTuple(width, height)
+
+
+def read_y4m_frame(file: BinaryIO, frame_data: memoryview) -> bool:
+    # Returns False at the end of the stream
+    header = file.readline()
+
+    if not header:
+        return False
+
+    if not header.startswith(b'FRAME'):
+        raise ValueError('Expected a frame header')
+
+    frame_data_read = 0
+
+    while frame_data_read < len(frame_data):
+        read_size = file.readinto(frame_data[frame_data_read:])
+
+        if not read_size:
+            return False
+
+        frame_data_read += read_size
+
+    return True
+
+
+def get_video_duration(input_url: str) -> float:
     output = subprocess.check_output([
-        'ffprobe', '-v', 'error', '-show_entries', 'stream=width,height',
+        'ffprobe', '-v', 'error', '-show_entries', 'format=duration',
         '-of', 'json', input_url
     ]).decode('utf-8')
 
     info = json.loads(output)
 
-    for stream in info['streams']:
-        if 'width' in stream:
-            return Size2DTuple(stream['width'], stream['height'])
+    return float(info['format']['duration'])
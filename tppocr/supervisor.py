@@ -0,0 +1,103 @@
+import argparse
+import glob
+import logging
+import os
+import signal
+from typing import Iterable, List
+
+from tppocr.__main__ import StreamRunner, read_config
+from tppocr.tesseract import TesseractAPIPool
+
+_logger = logging.getLogger(__name__)
+
+
+def get_config_filenames(paths: Iterable[str]) -> List[str]:
+    config_filenames = []
+
+    for path in paths:
+        if os.path.isdir(path):
+            config_filenames.extend(
+                sorted(glob.glob(os.path.join(path, '*.ini')))
+            )
+        else:
+            config_filenames.append(path)
+
+    return config_filenames
+
+
+def get_default_channel_prefix(config_filename: str) -> str:
+    return os.path.splitext(os.path.basename(config_filename))[0] + '.'
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(
+        description='Run the OCR of several streams in one process'
+    )
+    arg_parser.add_argument('config_paths', nargs='+', metavar='config_path',
+                            help='Config file or directory of .ini files')
+    arg_parser.add_argument('--tesseract-pool-size', type=int,
+                            help='Maximum number of Tesseract APIs started '
+                                 'for each language and set of variables. '
+                                 'By default, an API is started whenever '
+                                 'all of them are in use.')
+    arg_parser.add_argument('--debug', action='store_true')
+
+    args = arg_parser.parse_args()
+
+    logging.basicConfig(level=logging.DEBUG if args.debug else logging.INFO,
+                        format='%(asctime)s - %(levelname)s - %(message)s')
+
+    config_filenames = get_config_filenames(args.config_paths)
+
+    if not config_filenames:
+        raise ValueError('No config files found')
+
+    # Sections with the same language and Tesseract variables reuse the
+    # idle APIs instead of each loading the language data
+    api_pool = TesseractAPIPool(args.tesseract_pool_size)
+    runners = []
+    channel_prefixes = set()
+
+    for config_filename in config_filenames:
+        _logger.info('Loading config %s', config_filename)
+        config = read_config(config_filename)
+        channel_prefix = config['redis'].get('channel_prefix') or \
+            get_default_channel_prefix(config_filename)
+
+        if channel_prefix in channel_prefixes:
+            raise ValueError('Channel prefix {} of {} is already used'
+                             .format(channel_prefix, config_filename))
+
+        channel_prefixes.add(channel_prefix)
+        runners.append(StreamRunner(config, config_filename, channel_prefix,
+                                    api_pool))
+
+    def stop_handler(dummy1, dummy2):
+        for runner in runners:
+            runner.stop()
+
+    signal.signal(signal.SIGINT, stop_handler)
+
+    for runner in runners:
+        _logger.info('Starting stream %s', runner.channel_prefix)
+        runner.start()
+
+    running_runners = list(runners)
+
+    while running_runners:
+        for runner in running_runners:
+            runner.join(timeout=1)
+
+        for runner in tuple(running_runners):
+            if not runner.is_alive():
+                _logger.info('Stream %s stopped', runner.channel_prefix)
+                runner.shutdown()
+                running_runners.remove(runner)
+
+    api_pool.close()
+
+    _logger.info('Exiting')
+
+
+if __name__ == '__main__':
+    main()
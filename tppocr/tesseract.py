@@ -0,0 +1,137 @@
+import collections
+import contextlib
+import logging
+import threading
+from typing import Dict, Hashable, Iterator, Optional, Tuple
+
+import tesserocr
+
+_logger = logging.getLogger(__name__)
+
+APIKeyTuple = Tuple[str, Tuple[Tuple[str, str], ...], int, Hashable]
+
+
+def new_tesseract_api(language: str, variables: Dict[str, str],
+                      psm: int=tesserocr.PSM.AUTO) -> tesserocr.PyTessBaseAPI:
+    api = tesserocr.PyTessBaseAPI(lang=language, psm=psm)
+    api.SetVariable('tessedit_write_images', 'T')
+
+    for key, value in variables.items():
+        _logger.info('Setting tesseract variable %s=%s', key, value)
+        api.SetVariable(key, value)
+
+    return api
+
+
+class TesseractAPIPool:
+    # Shares initialised Tesseract APIs so the language data is loaded once
+    # per API instead of once per OCR section. APIs are keyed by language,
+    # variables and page segmentation mode. Up to size APIs per key are
+    # started, as they are needed by sections recognizing at the same time.
+    # With no size, an API is started whenever all of them are in use.
+    #
+    # The adaptive classifier learns from each recognition, so an owner
+    # that keeps what it learned has APIs of its own. Shared APIs must have
+    # their adaptive classifier cleared when they are checked in.
+    def __init__(self, size: Optional[int]=1):
+        if size is not None and size < 1:
+            raise ValueError('Pool size must be at least 1')
+
+        self._size = size
+        self._condition = threading.Condition()
+        self._idle_apis = collections.defaultdict(list)
+        self._api_counts = collections.Counter()
+        # Keys by the id of the API
+        self._checked_out_keys = {}
+        self._closed = False
+
+    @property
+    def size(self) -> Optional[int]:
+        return self._size
+
+    def checkout(self, language: str, variables: Dict[str, str],
+                 psm: int=tesserocr.PSM.AUTO, owner: Hashable=None) \
+            -> tesserocr.PyTessBaseAPI:
+        # An API checked out with an owner is only given to that owner
+        key = (language, tuple(sorted(variables.items())), psm, owner)
+
+        with self._condition:
+            while True:
+                if self._closed:
+                    raise ValueError('Pool is closed')
+
+                idle_apis = self._idle_apis[key]
+
+                if idle_apis:
+                    api = idle_apis.pop()
+                    break
+
+                if self._size is None or self._api_counts[key] < self._size:
+                    self._api_counts[key] += 1
+                    api = None
+                    break
+
+                self._condition.wait()
+
+        if api is None:
+            # Loading the language data is slow so it is done unlocked
+            _logger.info('Starting tesseract API %d for %s',
+                         self._api_counts[key], language)
+
+            try:
+                api = new_tesseract_api(language, variables, psm)
+            except Exception:
+                with self._condition:
+                    self._api_counts[key] -= 1
+                    self._condition.notify_all()
+                raise
+
+        with self._condition:
+            self._checked_out_keys[id(api)] = key
+
+        return api
+
+    def checkin(self, api: tesserocr.PyTessBaseAPI,
+                clear_adaptive_classifier: bool=False):
+        with self._condition:
+            key = self._checked_out_keys.pop(id(api))
+
+        # Free the image and results of the last recognition
+        api.Clear()
+
+        if clear_adaptive_classifier:
+            api.ClearAdaptiveClassifier()
+
+        with self._condition:
+            if self._closed:
+                api.End()
+            else:
+                self._idle_apis[key].append(api)
+                self._condition.notify_all()
+
+    @contextlib.contextmanager
+    def acquire(self, language: str, variables: Dict[str, str],
+                psm: int=tesserocr.PSM.AUTO, owner: Hashable=None,
+                clear_adaptive_classifier: bool=False) \
+            -> Iterator[tesserocr.PyTessBaseAPI]:
+        # An owner that keeps what the adaptive classifier learned can't
+        # share its APIs
+        api = self.checkout(language, variables, psm,
+                            None if clear_adaptive_classifier else owner)
+
+        try:
+            yield api
+        finally:
+            self.checkin(api, clear_adaptive_classifier)
+
+    def close(self):
+        # APIs still checked out are ended when they are checked in
+        with self._condition:
+            self._closed = True
+
+            for idle_apis in self._idle_apis.values():
+                for api in idle_apis:
+                    api.End()
+
+            self._idle_apis.clear()
+            self._condition.notify_all()
@@ -1,44 +1,45 @@
-import base64
-import difflib
-import json
 import io
 import collections
 import logging
 import time
 
-import redis
 import PIL.Image
 from typing import List, Optional
 
-PUBLISH_CHANNEL = 'tppocr'
+from tppocr.metrics import Metrics
+from tppocr.publisher import RedisPublisher
+from tppocr.similarity import is_similar
+from tppocr.wire import WireEncoder, encode_json
+
 TEXT_LIST_KEY = 'tppocr.recent_text'
 TEXT_LIST_LIMIT = 1000
 DEFAULT_TEXT_BUFFER_TIME = 20
+MIN_CONFIDENCE = 50
 
 _logger = logging.getLogger(__name__)
 
+# A line of text recognized on its own, such as a band of a line layout
+RecognizedLine = collections.namedtuple(
+    'RecognizedLine', ['text', 'confidence']
+)
 
-class TextBlock:
-    matcher = difflib.SequenceMatcher(isjunk=lambda x: x in ' \n')
 
-    def __init__(self, text: str):
+class TextBlock:
+    def __init__(self, text: str, timestamp: float=None):
         self.text = text
-        self.timestamp = time.time()
+        self.timestamp = time.time() if timestamp is None else timestamp
         self.touch_timestamp = self.timestamp
 
-        self.matcher.set_seq2(text)
-
-    def append_text(self, new_text: str) -> bool:
-        self.matcher.set_seq1(new_text[:len(self.text)])
+    def append_text(self, new_text: str, timestamp: float=None) -> bool:
         threshold = 0.6 if len(new_text) < 10 else 0.7
-        ratio = self.matcher.ratio()
+        similar = is_similar(new_text[:len(self.text)], self.text, threshold)
 
-        _logger.debug('Append ratio %s (%s)', ratio, threshold)
+        _logger.debug('Append similar %s (%s)', similar, threshold)
 
-        if ratio > threshold:
+        if similar:
             self.text = new_text
-            self.matcher.set_seq2(self.text)
-            self.touch_timestamp = time.time()
+            self.touch_timestamp = \
+                time.time() if timestamp is None else timestamp
             return True
         else:
             return False
@@ -58,87 +59,137 @@ class TextLine:
 
 
 class TextFilter:
-    line_matcher = difflib.SequenceMatcher()
-
-    def __init__(self, redis_conn: redis.StrictRedis):
-        self._redis_conn = redis_conn
+    # The timestamp arguments are the time of the frame in the video. When
+    # omitted, the current time is used.
+    def __init__(self, publisher: RedisPublisher, metrics: Metrics=None,
+                 wire_format: str='json', channel_prefix: str=''):
+        self._publisher = publisher
+        self._wire_encoder = WireEncoder(wire_format, channel_prefix)
+        self._text_list_key = channel_prefix + TEXT_LIST_KEY
+        self._metrics = metrics or Metrics()
+        self._last_raw_texts = {}
         self._text_blocks = collections.defaultdict(collections.deque)
         self._text_lines = collections.defaultdict(collections.deque)
 
     def feed_text(self, text: str, confidence: int=100,
-                  section: Optional[str]=None):
-        self._publish_raw_text(text, confidence, section)
-        _logger.debug('Raw text %s %s', ascii(text), confidence)
+                  section: Optional[str]=None, timestamp: float=None):
+        with self._metrics.measure('text_filter'):
+            self._publish_raw_text(text, confidence, section, timestamp)
+            _logger.debug('Raw text %s %s', ascii(text), confidence)
+
+            if text != self._last_raw_texts.get(section):
+                self._last_raw_texts[section] = text
+                self._metrics.increment('text_changes')
+
+            if confidence > MIN_CONFIDENCE:
+                self._add_new_text(text, section, timestamp)
+
+            self._publish_text_lines(timestamp=timestamp)
 
-        if confidence > 50:
-            self._add_new_text(text, section)
+    def feed_lines(self, lines: List[RecognizedLine], confidence: int=100,
+                   section: Optional[str]=None, timestamp: float=None):
+        # Like feed_text, but a line whose own confidence is too low is
+        # left out instead of the whole text
+        text = '\n'.join(line.text for line in lines if line.text)
 
-        self._publish_text_lines()
+        with self._metrics.measure('text_filter'):
+            self._publish_raw_text(text, confidence, section, timestamp,
+                                   lines)
+            _logger.debug('Raw lines %s', ascii(lines))
 
-    def flush_text(self, buffer_time: float=DEFAULT_TEXT_BUFFER_TIME):
-        self._publish_text_lines(buffer_time)
+            if text != self._last_raw_texts.get(section):
+                self._last_raw_texts[section] = text
+                self._metrics.increment('text_changes')
 
-    def feed_image(self, image: PIL.Image.Image, section: str=None):
-        self._publish_image(image, section=section)
+            confident_text = '\n'.join(
+                line.text for line in lines
+                if line.text and line.confidence > MIN_CONFIDENCE
+            )
+
+            if confident_text:
+                self._add_new_text(confident_text, section, timestamp)
+
+            self._publish_text_lines(timestamp=timestamp)
+
+    def flush_text(self, buffer_time: float=DEFAULT_TEXT_BUFFER_TIME,
+                   timestamp: float=None):
+        with self._metrics.measure('text_filter'):
+            self._publish_text_lines(buffer_time, timestamp)
+
+    def feed_image(self, image: PIL.Image.Image, section: str=None,
+                   quality: int=75):
+        self._publish_image(image, section=section, quality=quality)
 
     def _publish_raw_text(self, text: str, confidence: Optional[float]=None,
-                          section: str=None):
+                          section: str=None, timestamp: float=None,
+                          lines: Optional[List[RecognizedLine]]=None):
         doc = {
             'type': 'raw_text',
             'text': text,
-            'timestamp': time.time(),
+            'timestamp': time.time() if timestamp is None else timestamp,
             'confidence': confidence,
             'section': section
         }
-        json_str = json.dumps(doc)
 
-        self._redis_conn.publish(PUBLISH_CHANNEL, json_str)
+        if lines is not None:
+            doc['lines'] = list(
+                {'text': line.text, 'confidence': line.confidence}
+                for line in lines
+            )
+
+        self._publish_doc(doc, droppable=True)
 
     def _publish_text(self, text: str, timestamp: float=None,
                       section: str=None):
         doc = {
             'type': 'output_text',
             'text': text,
-            'timestamp': timestamp or time.time(),
+            'timestamp': time.time() if timestamp is None else timestamp,
             'section': section
         }
-        json_str = json.dumps(doc)
 
-        self._redis_conn.rpush(TEXT_LIST_KEY, json_str)
-        self._redis_conn.ltrim(TEXT_LIST_KEY, -TEXT_LIST_LIMIT, -1)
-        self._redis_conn.publish(PUBLISH_CHANNEL, json_str)
+        # The recent text list is always JSON
+        self._publisher.append_list(self._text_list_key, encode_json(doc),
+                                    TEXT_LIST_LIMIT)
+        self._publish_doc(doc)
 
         _logger.debug('Publish text %s', text)
 
-    def _publish_image(self, image: PIL.Image.Image, section: str=None):
+    def _publish_image(self, image: PIL.Image.Image, section: str=None,
+                       quality: int=75):
         buffer = io.BytesIO()
-        image.save(buffer, format='jpeg')
+        image.save(buffer, format='jpeg', quality=quality)
         doc = {
             'type': 'debug_image',
-            'image': base64.b64encode(buffer.getvalue()).decode('ascii'),
-            'format': 'image/jpeg;base64',
+            'image': buffer.getvalue(),
+            'format': 'image/jpeg',
             'timestamp': time.time(),
             'section': section
         }
-        json_str = json.dumps(doc)
 
-        self._redis_conn.publish(PUBLISH_CHANNEL, json_str)
+        self._publish_doc(doc, droppable=True)
+
+    def _publish_doc(self, doc: dict, droppable: bool=False):
+        for channel, message in self._wire_encoder.encode(doc):
+            self._publisher.publish(channel, message, droppable=droppable)
 
-    def _add_new_text(self, text: str, section: Optional[str]=None):
+    def _add_new_text(self, text: str, section: Optional[str]=None,
+                      timestamp: float=None):
         if not self._text_blocks[section]:
-            self._text_blocks[section].append(TextBlock(text))
+            self._text_blocks[section].append(TextBlock(text, timestamp))
             _logger.debug('Created new text block %s', ascii(text))
         else:
             text_block = self._text_blocks[section][-1]
 
-            if not text_block.append_text(text):
-                self._text_blocks[section].append(TextBlock(text))
+            if not text_block.append_text(text, timestamp):
+                self._text_blocks[section].append(TextBlock(text, timestamp))
                 _logger.debug('Created new text block %s', ascii(text))
             else:
                 _logger.debug('Append to text block %s', ascii(text_block.text))
 
-    def _split_text_blocks(self, buffer_time: float=DEFAULT_TEXT_BUFFER_TIME):
-        current_timestamp = time.time()
+    def _split_text_blocks(self, buffer_time: float=DEFAULT_TEXT_BUFFER_TIME,
+                           timestamp: float=None):
+        current_timestamp = time.time() if timestamp is None else timestamp
 
         for section, text_blocks in self._text_blocks.items():
             while text_blocks:
@@ -156,9 +207,10 @@ class TextFilter:
                                  text_block.touch_timestamp)
                     )
 
-    def _publish_text_lines(self, buffer_time: float=DEFAULT_TEXT_BUFFER_TIME):
-        self._split_text_blocks(buffer_time)
-        current_timestamp = time.time()
+    def _publish_text_lines(self, buffer_time: float=DEFAULT_TEXT_BUFFER_TIME,
+                            timestamp: float=None):
+        self._split_text_blocks(buffer_time, timestamp)
+        current_timestamp = time.time() if timestamp is None else timestamp
 
         for section, text_lines in self._text_lines.items():
             if not text_lines:
@@ -173,14 +225,13 @@ class TextFilter:
                 return
 
             lines = []
-            timestamp = None
+            text_timestamp = None
 
             while text_lines:
                 text_line = text_lines.popleft()
 
                 if lines:
-                    self.line_matcher.set_seqs(text_line.text, lines[-1])
-                    if self.line_matcher.ratio() > 0.9:
+                    if is_similar(text_line.text, lines[-1], 0.9):
                         _logger.debug('Skipped text line %s %s',
                                       ascii(text_line.text), ascii(lines[-1]))
                         continue
@@ -188,7 +239,7 @@ class TextFilter:
                 lines.append(text_line.text)
                 _logger.debug('Appended text line %s', ascii(text_line.text))
 
-                if not timestamp:
-                    timestamp = text_line.timestamp
+                if text_timestamp is None:
+                    text_timestamp = text_line.timestamp
 
-            self._publish_text('\n'.join(lines), timestamp, section)
+            self._publish_text('\n'.join(lines), text_timestamp, section)
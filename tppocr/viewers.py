@@ -0,0 +1,64 @@
+import logging
+import threading
+from typing import Iterable, Optional
+
+import redis
+
+_logger = logging.getLogger(__name__)
+
+# The web app sets the number of connected clients with a TTL so the count
+# disappears if the web app stops
+VIEWER_COUNT_KEY = 'tppocr.viewers'
+VIEWER_COUNT_TTL = 30
+
+
+def get_viewer_count_key(section: Optional[str]=None,
+                         channel_prefix: str='') -> str:
+    if section is None:
+        return channel_prefix + VIEWER_COUNT_KEY
+    else:
+        return '{}{}.{}'.format(channel_prefix, VIEWER_COUNT_KEY, section)
+
+
+class ViewerMonitor(threading.Thread):
+    # Polls the viewer counts so OCR only renders debug images that will be
+    # watched. A viewer of all sections is counted by the key without a
+    # section.
+    def __init__(self, redis_conn: redis.StrictRedis, sections: Iterable[str],
+                 interval: float=5, channel_prefix: str=''):
+        super().__init__(daemon=True)
+        self._redis_conn = redis_conn
+        self._sections = tuple(sections)
+        self._channel_prefix = channel_prefix
+        self._interval = interval
+        self._viewer_counts = {}
+        self._stop_event = threading.Event()
+
+    def has_viewers(self, section: Optional[str]=None) -> bool:
+        return bool(self._viewer_counts.get(None) or
+                    self._viewer_counts.get(section))
+
+    def stop(self):
+        self._stop_event.set()
+
+    def run(self):
+        while True:
+            try:
+                self._poll()
+            except redis.RedisError:
+                _logger.exception('Poll viewer counts')
+
+            if self._stop_event.wait(self._interval):
+                break
+
+    def _poll(self):
+        sections = (None,) + self._sections
+        values = self._redis_conn.mget(
+            list(get_viewer_count_key(section, self._channel_prefix)
+                 for section in sections)
+        )
+
+        self._viewer_counts = dict(
+            (section, int(value or 0))
+            for section, value in zip(sections, values)
+        )
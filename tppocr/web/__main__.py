@@ -1,8 +1,9 @@
 import argparse
 
-import redis
+import redis.asyncio
 import tornado.ioloop
 
+from tppocr.pub.archive import TextArchive
 from tppocr.web.app import App
 
 
@@ -15,6 +16,16 @@ def main():
     arg_parser.add_argument('--redis-port', default=6379, type=int)
     arg_parser.add_argument('--redis-db', default=0, type=int)
     arg_parser.add_argument('--debug', action='store_true')
+    arg_parser.add_argument('--wire-format', default='json',
+                            choices=['json', 'msgpack'],
+                            help='Format of the subscribed messages')
+    arg_parser.add_argument('--channel-prefix', default='',
+                            help='Prefix of the Redis channels and keys of '
+                                 'the stream')
+    arg_parser.add_argument(
+        '--archive',
+        help='SQLite database written by tppocr.pub.archive to search'
+    )
     arg_parser.add_argument(
         '--path-prefix', default='',
         help='Prefix to the URL path to run app on something other than /'
@@ -22,11 +33,19 @@ def main():
 
     args = arg_parser.parse_args()
 
-    redis_conn = redis.StrictRedis(args.redis_host, args.redis_port,
-                                   args.redis_db, decode_responses=True,
-                                   errors='replace')
+    async_redis_conn = redis.asyncio.StrictRedis(
+        args.redis_host, args.redis_port, args.redis_db,
+        decode_responses=args.wire_format == 'json', errors='replace'
+    )
+
+    if args.archive:
+        archive = TextArchive(args.archive, read_only=True)
+    else:
+        archive = None
 
-    app = App(redis_conn, debug=args.debug, path_prefix=args.path_prefix)
+    app = App(async_redis_conn, debug=args.debug,
+              path_prefix=args.path_prefix, wire_format=args.wire_format,
+              archive=archive, channel_prefix=args.channel_prefix)
     app.listen(args.port, xheaders=args.xheaders)
     tornado.ioloop.IOLoop.current().start()
 
@@ -1,24 +1,59 @@
+import asyncio
+import collections
+import concurrent.futures
 import json
+import logging
 import os
+import sqlite3
+import time
+import zlib
+from typing import Optional, Union
 
 import redis
+import redis.asyncio
 import tornado.web
 import tornado.websocket
 import tornado.ioloop
 
-from tppocr.text import TEXT_LIST_KEY, PUBLISH_CHANNEL
+from tppocr.pub.archive import TextArchive, SEARCH_LIMIT
+from tppocr.web.recent import RecentTextCache
+from tppocr.viewers import VIEWER_COUNT_TTL, get_viewer_count_key
+from tppocr.wire import get_subscribe_channel, decode_message
+
+_logger = logging.getLogger(__name__)
+
+
+def _is_str_list(value) -> bool:
+    return isinstance(value, list) and \
+        all(isinstance(item, str) for item in value)
 
 
 class App(tornado.web.Application):
-    def __init__(self, redis_conn: redis.StrictRedis, debug=False,
-                 path_prefix: str=''):
-        self.redis_conn = redis_conn
+    def __init__(self, async_redis_conn: redis.asyncio.StrictRedis,
+                 debug=False, path_prefix: str='', wire_format: str='json',
+                 archive: Optional[TextArchive]=None,
+                 channel_prefix: str=''):
+        # msgpack messages are forwarded to the websocket clients as binary
+        # frames so the connection must not decode responses
+        self.async_redis_conn = async_redis_conn
+        self.recent_texts = RecentTextCache()
+        self.wire_format = wire_format
+        self.channel_prefix = channel_prefix
+        self.channel = get_subscribe_channel(wire_format, channel_prefix)
+        self.archive = archive
+        # SQLite queries block so they run on a thread that owns the
+        # connection
+        self.archive_executor = concurrent.futures.ThreadPoolExecutor(1)
         handlers = [
             (path_prefix + r'/', IndexHandler),
             (path_prefix + r'/api/events', EventsHandler),
-            (path_prefix + r'/api/recent', RecentHandler)
+            (path_prefix + r'/api/recent', RecentHandler),
+            (path_prefix + r'/api/stats', StatsHandler),
         ]
 
+        if archive:
+            handlers.append((path_prefix + r'/api/search', SearchHandler))
+
         template_path = os.path.join(os.path.dirname(__file__), 'templates')
         static_path = os.path.join(os.path.dirname(__file__), 'static')
         super().__init__(
@@ -29,21 +64,75 @@ class App(tornado.web.Application):
             debug=debug
         )
 
-        self.pubsub = self.redis_conn.pubsub()
-        self.pubsub.subscribe(PUBLISH_CHANNEL)
+        tornado.ioloop.IOLoop.current().spawn_callback(self._run_pubsub)
+
+        self.viewer_count_timer = tornado.ioloop.PeriodicCallback(
+            self.update_viewer_count, VIEWER_COUNT_TTL * 1000 / 3
+        )
+        self.viewer_count_timer.start()
+
+    async def update_viewer_count(self):
+        # OCR stops publishing debug images when the count expires
+        viewer_counts = collections.Counter()
 
-        self.pubsub_timer = tornado.ioloop.PeriodicCallback(self._poll_pubsub, 100)
-        self.pubsub_timer.start()
+        for handler in EventsHandler.handlers:
+            if not handler.is_debug_image_viewer():
+                continue
 
-    def _poll_pubsub(self):
-        for dummy in range(10):
-            message = self.pubsub.get_message()
-            if message:
-                if message.get('channel') == PUBLISH_CHANNEL and \
-                        message.get('type') == 'message':
-                    EventsHandler.pubsub_handler(message)
+            if handler.sections is None:
+                viewer_counts[None] += 1
             else:
-                break
+                viewer_counts.update(handler.sections)
+
+        if not viewer_counts:
+            return
+
+        try:
+            pipeline = self.async_redis_conn.pipeline(transaction=False)
+
+            for section, viewer_count in viewer_counts.items():
+                key = get_viewer_count_key(section, self.channel_prefix)
+                pipeline.set(key, viewer_count, ex=VIEWER_COUNT_TTL)
+
+            await pipeline.execute()
+        except redis.RedisError:
+            _logger.exception('Update viewer count')
+
+    def _handle_message(self, message):
+        # Decoded once here for filtering. The clients receive the
+        # original data. A bad message must not end the subscription.
+        try:
+            doc = decode_message(message['data'], self.wire_format)
+
+            if not doc:
+                return
+
+            if doc.get('type') == 'output_text':
+                self.recent_texts.add(doc)
+
+            EventsHandler.pubsub_handler(message, doc)
+        except Exception:
+            _logger.exception('Handle message')
+
+    async def _run_pubsub(self):
+        while True:
+            try:
+                async with self.async_redis_conn.pubsub() as pubsub:
+                    await pubsub.subscribe(self.channel)
+                    # Fill in texts missed while not subscribed
+                    await self.recent_texts.load(self.async_redis_conn,
+                                                 self.channel_prefix)
+
+                    channels = (self.channel, self.channel.encode())
+
+                    async for message in pubsub.listen():
+                        if message.get('channel') in channels and \
+                                message.get('type') == 'message':
+                            self._handle_message(message)
+            except redis.RedisError:
+                _logger.exception('Redis subscription failed. Resubscribing '
+                                  'in 5 seconds.')
+                await asyncio.sleep(5)
 
 
 class IndexHandler(tornado.web.RequestHandler):
@@ -58,27 +147,288 @@ class IndexHandler(tornado.web.RequestHandler):
         self.render('index.html', news_html=news_html)
 
 
+class ClientSendQueue:
+    # Messages waiting to be sent to one websocket client. Only the latest
+    # debug image of each section is kept. When the queue is full, the
+    # oldest raw text (or other frequent message) is dropped before the
+    # oldest output text.
+    def __init__(self, max_size: int=100):
+        self._max_size = max_size
+        self._messages = collections.deque()
+        self._images = collections.OrderedDict()
+        self._event = asyncio.Event()
+        self._closed = False
+        self.queued_bytes = 0
+        self.sent_count = 0
+        self.dropped_count = 0
+        self.coalesced_count = 0
+
+    def put(self, doc_type: str, section: Optional[str],
+            data: Union[str, bytes]):
+        if doc_type == 'debug_image':
+            old_data = self._images.pop(section, None)
+
+            if old_data is not None:
+                self.coalesced_count += 1
+                self.queued_bytes -= len(old_data)
+
+            self._images[section] = data
+        else:
+            if len(self._messages) >= self._max_size:
+                self._drop_message()
+
+            self._messages.append((doc_type, data))
+
+        self.queued_bytes += len(data)
+        self._event.set()
+
+    def close(self):
+        self._closed = True
+        self._event.set()
+
+    async def get(self) -> Optional[Union[str, bytes]]:
+        # Returns None when closed
+        while not self._messages and not self._images:
+            if self._closed:
+                return None
+
+            self._event.clear()
+            await self._event.wait()
+
+        if self._closed:
+            return None
+
+        if self._messages:
+            doc_type, data = self._messages.popleft()
+        else:
+            section, data = self._images.popitem(last=False)
+
+        self.queued_bytes -= len(data)
+        self.sent_count += 1
+
+        return data
+
+    def get_stats(self) -> dict:
+        return {
+            'queued_messages': len(self._messages),
+            'queued_images': len(self._images),
+            'queued_bytes': self.queued_bytes,
+            'sent': self.sent_count,
+            'dropped': self.dropped_count,
+            'coalesced': self.coalesced_count,
+        }
+
+    def _drop_message(self):
+        for index, (doc_type, data) in enumerate(self._messages):
+            if doc_type != 'output_text':
+                break
+        else:
+            index = 0
+
+        doc_type, data = self._messages[index]
+        del self._messages[index]
+        self.queued_bytes -= len(data)
+        self.dropped_count += 1
+
+        time_now = time.time()
+        if time_now - EventsHandler.log_cooldown_timestamp > 60:
+            _logger.warning('Websocket client send queue full. Dropping '
+                            'messages.')
+            EventsHandler.log_cooldown_timestamp = time_now
+
+
 class EventsHandler(tornado.websocket.WebSocketHandler):
+    # Clients receive every section and message type unless they send a
+    # control message such as:
+    # {"type": "subscribe", "sections": ["SongTitle"], "types": ["raw_text"]}
+    # where a missing or null list means all of them.
+    SEND_QUEUE_SIZE = 100
+
     handlers = set()
+    log_cooldown_timestamp = 0
+
+    def initialize(self):
+        self.send_queue = ClientSendQueue(self.SEND_QUEUE_SIZE)
+        self.sections = None
+        self.types = None
+        self.open_timestamp = time.time()
 
     @classmethod
-    def pubsub_handler(cls, message):
+    def pubsub_handler(cls, message, doc: dict):
         for handler in cls.handlers:
-            handler.write_message(message['data'])
+            if handler.is_subscribed(doc):
+                handler.send_queue.put(
+                    doc.get('type'), doc.get('section'), message['data']
+                )
+
+    def is_subscribed(self, doc: dict) -> bool:
+        return (self.types is None or doc.get('type') in self.types) and \
+            (self.sections is None or doc.get('section') in self.sections)
+
+    def is_debug_image_viewer(self) -> bool:
+        return self.types is None or 'debug_image' in self.types
+
+    def get_stats(self) -> dict:
+        stats = self.send_queue.get_stats()
+        stats['sections'] = sorted(self.sections) \
+            if self.sections is not None else None
+        stats['types'] = sorted(self.types) if self.types is not None else None
+        stats['connected_time'] = time.time() - self.open_timestamp
+
+        return stats
 
     def open(self):
         self.handlers.add(self)
+        tornado.ioloop.IOLoop.current().spawn_callback(self._send_messages)
+
+        if len(self.handlers) == 1:
+            tornado.ioloop.IOLoop.current().spawn_callback(
+                self.application.update_viewer_count
+            )
+
+    def on_message(self, message):
+        try:
+            doc = json.loads(message)
+        except ValueError:
+            _logger.debug('Invalid websocket message')
+            return
+
+        if not isinstance(doc, dict) or doc.get('type') != 'subscribe':
+            return
+
+        sections = doc.get('sections')
+        types = doc.get('types')
+        self.sections = set(sections) if _is_str_list(sections) else None
+        self.types = set(types) if _is_str_list(types) else None
+
+        tornado.ioloop.IOLoop.current().spawn_callback(
+            self.application.update_viewer_count
+        )
 
     def on_close(self):
         self.handlers.remove(self)
+        self.send_queue.close()
+
+    async def _send_messages(self):
+        while True:
+            data = await self.send_queue.get()
+
+            if data is None:
+                break
+
+            try:
+                await self.write_message(data, binary=isinstance(data, bytes))
+            except tornado.websocket.WebSocketClosedError:
+                break
+
+
+class StatsHandler(tornado.web.RequestHandler):
+    def get(self):
+        connections = list(
+            handler.get_stats() for handler in EventsHandler.handlers
+        )
+        totals = {}
+
+        for key in ('queued_messages', 'queued_images', 'queued_bytes',
+                    'sent', 'dropped', 'coalesced'):
+            totals[key] = sum(stats[key] for stats in connections)
+
+        self.write({
+            'connection_count': len(connections),
+            'totals': totals,
+            'connections': connections,
+        })
 
 
 class RecentHandler(tornado.web.RequestHandler):
+    # Optional arguments:
+    # section: comma separated section names
+    # since: only texts with a timestamp after this Unix timestamp
     def get(self):
-        values = list(
-            json.loads(item)
-            for item in self.application.redis_conn.lrange(TEXT_LIST_KEY, 0, -1)
+        sections = self.get_argument('section', None)
+        since = self.get_argument('since', None)
+
+        if sections is not None:
+            sections = sections.split(',')
+
+        if since is not None:
+            try:
+                since = float(since)
+            except ValueError:
+                raise tornado.web.HTTPError(400, 'Invalid since')
+
+        body, gzip_body = self.application.recent_texts.get_response(
+            sections, since
+        )
+
+        self.set_header('Content-Type', 'application/json; charset=UTF-8')
+        self.set_header('Vary', 'Accept-Encoding')
+
+        if 'gzip' in self.request.headers.get('Accept-Encoding', ''):
+            self.set_header('Content-Encoding', 'gzip')
+            self.write(gzip_body)
+        else:
+            self.write(body)
+
+    def compute_etag(self) -> Optional[str]:
+        # The list version identifies the content without hashing it
+        return '"{}-{:x}-{}"'.format(
+            self.application.recent_texts.version,
+            zlib.crc32(self.request.query.encode()),
+            self._headers.get('Content-Encoding', 'identity')
         )
+
+
+class SearchHandler(tornado.web.RequestHandler):
+    # Optional arguments:
+    # q: SQLite FTS5 query
+    # section: comma separated section names
+    # start, end: Unix timestamp range
+    # before: id of the last text from the previous page
+    # limit: number of texts, up to SEARCH_LIMIT
+    async def get(self):
+        sections = self.get_argument('section', None)
+
+        if sections is not None:
+            sections = sections.split(',')
+
+        start = self._get_number_argument('start', float)
+        end = self._get_number_argument('end', float)
+        before_id = self._get_number_argument('before', int)
+        limit = self._get_number_argument('limit', int)
+
+        if limit is None:
+            limit = SEARCH_LIMIT
+        elif limit < 1:
+            # SQLite doesn't limit the rows with a negative limit
+            raise tornado.web.HTTPError(400, 'Invalid limit')
+        else:
+            limit = min(SEARCH_LIMIT, limit)
+
+        try:
+            texts = await tornado.ioloop.IOLoop.current().run_in_executor(
+                self.application.archive_executor,
+                lambda: self.application.archive.search(
+                    self.get_argument('q', None), sections, start, end,
+                    before_id, limit
+                )
+            )
+        except sqlite3.OperationalError as error:
+            # Usually a syntax error in the query
+            raise tornado.web.HTTPError(400, str(error))
+
         self.write({
-            'recent_texts': values
+            'texts': texts,
+            'next_before': texts[-1]['id'] if len(texts) == limit else None,
         })
+
+    def _get_number_argument(self, name: str, type_: type):
+        value = self.get_argument(name, None)
+
+        if value is None:
+            return None
+
+        try:
+            return type_(value)
+        except ValueError:
+            raise tornado.web.HTTPError(400, 'Invalid {}'.format(name))
@@ -0,0 +1,111 @@
+import collections
+import gzip
+import json
+import logging
+import os
+from typing import Optional, Iterable, Tuple
+
+import redis.asyncio
+
+from tppocr.text import TEXT_LIST_KEY, TEXT_LIST_LIMIT
+from tppocr.wire import encode_json
+
+_logger = logging.getLogger(__name__)
+
+# Section filters come from the clients, so only the most recently used
+# responses are kept
+MAX_CACHED_RESPONSES = 16
+
+RecentTextItem = collections.namedtuple(
+    'RecentTextItem', ['timestamp', 'section', 'json_str']
+)
+
+
+class RecentTextCache:
+    # Copy of the recent text list kept up to date from the pub/sub
+    # messages. Items are stored as JSON so responses are built without
+    # decoding and encoding each item again. Full responses are cached
+    # per section filter until the list changes.
+    def __init__(self, limit: int=TEXT_LIST_LIMIT):
+        self._items = collections.deque(maxlen=limit)
+        # Keeps versions unique across restarts
+        self._instance_id = os.urandom(4).hex()
+        self._version = 0
+        self._responses = collections.OrderedDict()
+
+    @property
+    def version(self) -> str:
+        return '{}.{}'.format(self._instance_id, self._version)
+
+    async def load(self, redis_conn: redis.asyncio.StrictRedis,
+                   channel_prefix: str=''):
+        values = await redis_conn.lrange(
+            channel_prefix + TEXT_LIST_KEY, 0, -1)
+        self._items.clear()
+
+        for value in values:
+            if isinstance(value, bytes):
+                value = value.decode('utf-8', 'replace')
+
+            try:
+                doc = json.loads(value)
+            except ValueError:
+                _logger.warning('Skipping invalid recent text %r', value)
+                continue
+
+            if not isinstance(doc, dict):
+                _logger.warning('Skipping invalid recent text %r', value)
+                continue
+
+            self._items.append(RecentTextItem(
+                doc.get('timestamp'), doc.get('section'), value
+            ))
+
+        self._changed()
+        _logger.info('Loaded %d recent texts', len(self._items))
+
+    def add(self, doc: dict):
+        doc = dict(doc)
+        doc.pop('version', None)
+        self._items.append(RecentTextItem(
+            doc.get('timestamp'), doc.get('section'), encode_json(doc)
+        ))
+        self._changed()
+
+    def get_response(self, sections: Optional[Iterable[str]]=None,
+                     since: Optional[float]=None) -> Tuple[bytes, bytes]:
+        # Returns the JSON body and its gzip compressed version
+        if sections is not None:
+            sections = frozenset(sections)
+
+        if since is None:
+            response = self._responses.get(sections)
+
+            if response:
+                self._responses.move_to_end(sections)
+            else:
+                response = self._responses[sections] = \
+                    self._build_response(sections, since)
+
+                if len(self._responses) > MAX_CACHED_RESPONSES:
+                    self._responses.popitem(last=False)
+
+            return response
+        else:
+            return self._build_response(sections, since)
+
+    def _build_response(self, sections: Optional[frozenset],
+                        since: Optional[float]) -> Tuple[bytes, bytes]:
+        json_strs = list(
+            item.json_str for item in self._items
+            if (sections is None or item.section in sections) and
+            (since is None or (item.timestamp or 0) > since)
+        )
+        body = '{{"recent_texts": [{}]}}'.format(', '.join(json_strs)) \
+            .encode('utf-8')
+
+        return body, gzip.compress(body)
+
+    def _changed(self):
+        self._version += 1
+        self._responses.clear()
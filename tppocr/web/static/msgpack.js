@@ -0,0 +1,107 @@
+// Minimal MessagePack decoder for the binary messages published with the
+// msgpack wire format. Binary values are returned as Uint8Array.
+function decodeMsgpack(buffer) {
+    var bytes = new Uint8Array(buffer);
+    var view = new DataView(bytes.buffer, bytes.byteOffset, bytes.byteLength);
+    var offset = 0;
+    var textDecoder = new TextDecoder("utf-8");
+
+    function readBytes(length) {
+        var value = bytes.subarray(offset, offset + length);
+        offset += length;
+        return value;
+    }
+
+    function readString(length) {
+        return textDecoder.decode(readBytes(length));
+    }
+
+    function readArray(length) {
+        var value = [];
+        for (var index = 0; index < length; index++) {
+            value.push(readValue());
+        }
+        return value;
+    }
+
+    function readMap(length) {
+        var value = {};
+        for (var index = 0; index < length; index++) {
+            var key = readValue();
+            value[key] = readValue();
+        }
+        return value;
+    }
+
+    function readUint(size) {
+        var value;
+        switch (size) {
+        case 1: value = view.getUint8(offset); break;
+        case 2: value = view.getUint16(offset); break;
+        case 4: value = view.getUint32(offset); break;
+        case 8: value = view.getUint32(offset) * 4294967296 + view.getUint32(offset + 4); break;
+        }
+        offset += size;
+        return value;
+    }
+
+    function readInt(size) {
+        var value;
+        switch (size) {
+        case 1: value = view.getInt8(offset); break;
+        case 2: value = view.getInt16(offset); break;
+        case 4: value = view.getInt32(offset); break;
+        case 8: value = view.getInt32(offset) * 4294967296 + view.getUint32(offset + 4); break;
+        }
+        offset += size;
+        return value;
+    }
+
+    function readValue() {
+        var type = view.getUint8(offset);
+        offset += 1;
+
+        if (type <= 0x7f) {
+            return type;
+        } else if (type <= 0x8f) {
+            return readMap(type & 0x0f);
+        } else if (type <= 0x9f) {
+            return readArray(type & 0x0f);
+        } else if (type <= 0xbf) {
+            return readString(type & 0x1f);
+        } else if (type >= 0xe0) {
+            return type - 0x100;
+        }
+
+        var value;
+
+        switch (type) {
+        case 0xc0: return null;
+        case 0xc2: return false;
+        case 0xc3: return true;
+        case 0xc4: return readBytes(readUint(1));
+        case 0xc5: return readBytes(readUint(2));
+        case 0xc6: return readBytes(readUint(4));
+        case 0xca: value = view.getFloat32(offset); offset += 4; return value;
+        case 0xcb: value = view.getFloat64(offset); offset += 8; return value;
+        case 0xcc: return readUint(1);
+        case 0xcd: return readUint(2);
+        case 0xce: return readUint(4);
+        case 0xcf: return readUint(8);
+        case 0xd0: return readInt(1);
+        case 0xd1: return readInt(2);
+        case 0xd2: return readInt(4);
+        case 0xd3: return readInt(8);
+        case 0xd9: return readString(readUint(1));
+        case 0xda: return readString(readUint(2));
+        case 0xdb: return readString(readUint(4));
+        case 0xdc: return readArray(readUint(2));
+        case 0xdd: return readArray(readUint(4));
+        case 0xde: return readMap(readUint(2));
+        case 0xdf: return readMap(readUint(4));
+        default: throw new Error("Unsupported msgpack type " + type);
+        }
+    }
+
+    return readValue();
+}
@@ -7,13 +7,44 @@ function main() {
     var outputTextsContainer = document.getElementById("output_texts_container");
     var reconnectTimer = null;
     var backoffCounter = 0;
+    var imageObjectURLs = {};
+    var WIRE_VERSION = 1;
 
     function handleMessage(message) {
-        var doc = JSON.parse(message.data);
+        var doc;
+
+        if (typeof message.data === "string") {
+            doc = JSON.parse(message.data);
+        } else {
+            doc = decodeMsgpack(message.data);
+        }
+
+        if (doc["version"] > WIRE_VERSION) {
+            console.warn("Unsupported message version", doc["version"]);
+            return;
+        }
 
         renderMessageDoc(doc);
     }
 
+    function getImageURL(doc) {
+        if (typeof doc["image"] === "string") {
+            return "data:" + doc["format"] + "," + doc["image"];
+        }
+
+        var section = doc["section"];
+
+        if (imageObjectURLs[section]) {
+            URL.revokeObjectURL(imageObjectURLs[section]);
+        }
+
+        imageObjectURLs[section] = URL.createObjectURL(
+            new Blob([doc["image"]], {"type": doc["format"]})
+        );
+
+        return imageObjectURLs[section];
+    }
+
     function renderMessageDoc(doc) {
         switch (doc["type"]) {
         case "debug_image":
@@ -37,7 +68,7 @@ function main() {
 
             $(containerElement).find(".debug_image").prop(
                 'src',
-                "data:" + doc["format"] + "," + doc["image"]
+                getImageURL(doc)
             )
             $(containerElement).find(".debug_image-time")
                 .attr("datetime", formattedDates["iso_date"])
@@ -117,9 +148,11 @@ function main() {
             window.location.host + window.location.pathname + "api/events"
         );
 
+        socket.binaryType = "arraybuffer";
         socket.onopen = function (event) {
             statusElement.textContent = "Connected";
             backoffCounter = 0;
+            subscribe(socket);
         }
         socket.onmessage = handleMessage;
         socket.onerror = function (event) {
@@ -133,6 +166,22 @@ function main() {
         }
     }
 
+    function subscribe(socket) {
+        // Optional filters from the page URL such as
+        // ?sections=SongTitle,NextSongTitle&types=raw_text,output_text
+        var params = new URLSearchParams(window.location.search);
+
+        if (!params.has("sections") && !params.has("types")) {
+            return;
+        }
+
+        socket.send(JSON.stringify({
+            "type": "subscribe",
+            "sections": params.has("sections") ? params.get("sections").split(",") : null,
+            "types": params.has("types") ? params.get("types").split(",") : null
+        }));
+    }
+
     function reconnect() {
         if (reconnectTimer) {
             return;
@@ -0,0 +1,83 @@
+import base64
+import json
+import logging
+from typing import List, Tuple, Optional, Union
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+_logger = logging.getLogger(__name__)
+
+PUBLISH_CHANNEL = 'tppocr'
+BINARY_PUBLISH_CHANNEL = 'tppocr.msgpack'
+WIRE_VERSION = 1
+WIRE_FORMATS = ('json', 'msgpack', 'both')
+
+
+class WireEncoder:
+    # Encodes documents for the pub/sub channels. JSON documents go to
+    # PUBLISH_CHANNEL with images as base64. msgpack documents go to
+    # BINARY_PUBLISH_CHANNEL with images as raw bytes. "both" publishes
+    # each document on both channels so subscribers can migrate. The
+    # channel prefix separates the streams sharing a Redis database.
+    def __init__(self, wire_format: str='json', channel_prefix: str=''):
+        if wire_format not in WIRE_FORMATS:
+            raise ValueError('Unknown wire format {}'.format(wire_format))
+
+        if wire_format != 'json' and not msgpack:
+            raise ImportError('msgpack is required for the {} wire format'
+                              .format(wire_format))
+
+        self._wire_format = wire_format
+        self._channel_prefix = channel_prefix
+
+    def encode(self, doc: dict) -> List[Tuple[str, Union[str, bytes]]]:
+        # Returns (channel, message) pairs. Images in the document are bytes.
+        messages = []
+        doc = dict(doc, version=WIRE_VERSION)
+
+        if self._wire_format in ('json', 'both'):
+            messages.append((self._channel_prefix + PUBLISH_CHANNEL,
+                             encode_json(doc)))
+
+        if self._wire_format in ('msgpack', 'both'):
+            messages.append((
+                self._channel_prefix + BINARY_PUBLISH_CHANNEL,
+                msgpack.packb(doc, use_bin_type=True)
+            ))
+
+        return messages
+
+
+def encode_json(doc: dict) -> str:
+    if isinstance(doc.get('image'), bytes):
+        doc = dict(doc)
+        doc['image'] = base64.b64encode(doc['image']).decode('ascii')
+        doc['format'] += ';base64'
+
+    return json.dumps(doc)
+
+
+def get_subscribe_channel(wire_format: str, channel_prefix: str='') -> str:
+    if wire_format == 'msgpack':
+        return channel_prefix + BINARY_PUBLISH_CHANNEL
+    else:
+        return channel_prefix + PUBLISH_CHANNEL
+
+
+def decode_message(data: Union[str, bytes], wire_format: str='json') -> \
+        Optional[dict]:
+    if wire_format == 'msgpack':
+        doc = msgpack.unpackb(data, raw=False)
+    else:
+        doc = json.loads(data)
+
+    # Documents without a version were published before it was added
+    if doc.get('version', WIRE_VERSION) > WIRE_VERSION:
+        _logger.warning('Ignoring document with unsupported version %s',
+                        doc['version'])
+        return None
+
+    return doc